@@ -4,21 +4,107 @@
 # from the National Palace Museum (Taipei).
 #
 # To run this script, you need
-#   1. Selenium configured with the Chrome WebDriver.
+#   1. Selenium configured with the Chrome WebDriver (`NPMCrawler`), or aiohttp
+#      (`AsyncNPMCrawler`, fetching pages over plain HTTP).
 #   2. Manually create:
 #     - A directory to save images;
 #     - A directory to save HTML;
-#     - A csv file to save mapping information of images to HTML files.
+#     - A csv file to save mapping information of images to HTML files (`NPMCrawler`
+#       only, `AsyncNPMCrawler` records them in a SQLite ledger instead).
 #   3. Edit the `if __name__ == "__main__":` block according to your situation.
 
 import sys
 import os
 import time
 import csv
+import random
+import socket
+import asyncio
+import hashlib
+from urllib.parse import urljoin, urlsplit, unquote
 from bs4 import BeautifulSoup
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
+from utils.crawl_ledger import CrawlLedger
+
+NPM_URL = "https://digitalarchive.npm.gov.tw"
+MAX_PID = 36598
+
+
+def parse_img_dpi(page_source):
+    """
+    Check download bottons of the html, there are three situations:
+        1. 100 DPI only;
+        2. 100 DPI, 600 DPI both;
+        3. no download botton.
+
+    This function return 100, 600 (if 100, 600 both) or none.
+    """
+    soup = BeautifulSoup(page_source, "html.parser")
+    try:
+        a = soup.find("a", id="a_600picture").attrs["style"]
+        # lack 600 DPI download botton. s.g. pid 14349
+        if "display: none;" in a:
+            return 100
+        else:
+            return 600
+    # also lack 100 DPI download botton. s.g. pid 36000
+    except AttributeError:
+        return None
+
+
+def parse_download_url(page_source, dpi, page_url):
+    """Get the (absolute) image URL of the download botton for a given DPI."""
+    id_v = "a_download" if dpi == 100 else "a_600picture"
+    soup = BeautifulSoup(page_source, "html.parser")
+    return urljoin(page_url, soup.find("a", id=id_v).attrs["href"])
+
+
+def get_existing_imgs(images_dir, filter_cr=True):
+    """
+    Get existed images (excluding currend downloading image).
+    ---
+    cr: bool, deciding filter crdownload or not.
+    """
+    imgs_dl = set(os.listdir(images_dir))
+    if filter_cr is True:
+        return set(filter(lambda x: x.split(".")[-1] != "crdownload", imgs_dl))
+    else:
+        return imgs_dl
+
+
+def fix_map_csv(images_dir, map_csv_path):
+    """
+    Fix 'map.csv' and images/ after an interrupted `NPMCrawler` run (see
+    `NPMCrawler.fix`): delete the '.crdownload' file, and add the image downloaded
+    last time but not yet added to 'map.csv'. Return the pid of the added image
+    (None if no image is added).
+    """
+    imgs_dl = get_existing_imgs(images_dir)
+
+    # delete the .crdownload file in images/
+    # note: in most cases, Chrome auto deletes '.crdownload'
+    # files, this is for handling exceptional situations.
+    imgs_cr = get_existing_imgs(images_dir, filter_cr=False) - imgs_dl
+    if len(imgs_cr) == 0:
+        pass
+    elif len(imgs_cr) == 1:
+        img_cr = imgs_cr.pop()
+        os.remove(images_dir + "/" + img_cr)
+    else:
+        print("More than one '.crdownload' file, please check manually.")
+
+    # add imgs downloaded last time which not yet added to map.csv
+    if os.path.getsize(map_csv_path) == 0:
+        return None  # quit if empty
+    with open(map_csv_path, "r") as f:
+        rows = list(csv.reader(f))
+    imgs_info = set([row[1] for row in rows])
+    next_pid = [int(row[0]) for row in rows][-1] + 1
+    with open(map_csv_path, "a") as f:
+        extra = imgs_dl - imgs_info
+        if bool(extra):
+            f.write(f"{next_pid},{next(iter(extra))}\n")
+            return next_pid
+    return None
 
 
 class NPMCrawler:
@@ -40,6 +126,9 @@ class NPMCrawler:
         ---
         headless: bool, deciding whether to run Chrome in headless mode.
         """
+        from selenium import webdriver
+        from selenium.webdriver.chrome.options import Options
+
         chrome_options = Options()
         if headless is True:
             chrome_options.add_argument("--headless=new")
@@ -65,11 +154,7 @@ class NPMCrawler:
         ---
         cr: bool, deciding filter crdownload or not.
         """
-        imgs_dl = set(os.listdir(self.images_dir))
-        if filter_cr is True:
-            return set(filter(lambda x: x.split(".")[-1] != "crdownload", imgs_dl))
-        else:
-            return imgs_dl
+        return get_existing_imgs(self.images_dir, filter_cr)
 
     def fix(self):
         """
@@ -79,55 +164,15 @@ class NPMCrawler:
         map.csv and your images/ by comparing
         existing images.
         """
-        imgs_dl = self.get_existing_imgs()
-
-        # delete the .crdownload file in images/
-        # note: in most cases, Chrome auto deletes '.crdownload'
-        # files, this is for handling exceptional situations.
-        imgs_cr = self.get_existing_imgs(filter_cr=False) - imgs_dl
-        if len(imgs_cr) == 0:
-            pass
-        elif len(imgs_cr) == 1:
-            img_cr = imgs_cr.pop()
-            os.remove(self.images_dir + "/" + img_cr)
-        else:
-            print("More than one '.crdownload' file, please check manually.")
-
-        # add imgs downloaded last time which not yet added to map.csv
-        if os.path.getsize(self.map_csv_path) == 0:
-            return True  # quit if empty
-        with open(self.map_csv_path, "r") as f:
-            rows = list(csv.reader(f))
-        imgs_info = set([row[1] for row in rows])
-        next_pid = [int(row[0]) for row in rows][-1] + 1
-        with open(self.map_csv_path, "a") as f:
-            extra = imgs_dl - imgs_info
-            if bool(extra):
-                f.write(f"{next_pid},{next(iter(extra))}\n")
-                self.max_info_pid = next_pid
+        next_pid = fix_map_csv(self.images_dir, self.map_csv_path)
+        if next_pid is not None:
+            self.max_info_pid = next_pid
 
     def get_img_dpi(self):
         """
-        Note: need your driver loaded a page already.
-
-        Check download bottons of the html, there are three situations:
-            1. 100 DPI only;
-            2. 100 DPI, 600 DPI both;
-            3. no download botton.
-
-        This function return 100, 600 (if 100, 600 both) or none.
+        Note: need your driver loaded a page already. See `parse_img_dpi`.
         """
-        soup = BeautifulSoup(self.driver.page_source, "html.parser")
-        try:
-            a = soup.find("a", id="a_600picture").attrs["style"]
-            # lack 600 DPI download botton. s.g. pid 14349
-            if "display: none;" in a:
-                return 100
-            else:
-                return 600
-        # also lack 100 DPI download botton. s.g. pid 36000
-        except AttributeError:
-            return None
+        return parse_img_dpi(self.driver.page_source)
 
     def download(self, pid, dpi):
         """
@@ -148,6 +193,8 @@ class NPMCrawler:
             return
 
         # download image
+        from selenium.webdriver.common.by import By
+
         dl_botton = self.driver.find_element(by=By.ID, value=id_v)
         imgs_before_dl = self.get_existing_imgs()
         dl_botton.click()
@@ -169,8 +216,8 @@ class NPMCrawler:
         will not be crawled.)
         """
         self.fix()
-        for pid in range(self.max_info_pid + 1, 36599):
-            url = f"https://digitalarchive.npm.gov.tw/Painting/Content?pid={pid}&Dept=P"
+        for pid in range(self.max_info_pid + 1, MAX_PID + 1):
+            url = f"{NPM_URL}/Painting/Content?pid={pid}&Dept=P"
             self.driver.get(url)
             self.download(pid, dpi=self.get_img_dpi())
             time.sleep(1)
@@ -178,6 +225,182 @@ class NPMCrawler:
         self.driver.quit()
 
 
+class TokenBucket:
+    """Rate limiter allowing `rate` requests per second, with bursts of `capacity`."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AsyncNPMCrawler:
+    """
+    A Crawler like `NPMCrawler`, fetching the pages and images over plain HTTP with
+    asyncio instead of driving Chrome, so that several pids are crawled at once.
+
+    Images are streamed to disk and recorded (DPI, file name, size, checksum) in a
+    `CrawlLedger` instead of 'map.csv'. Pids are claimed from the ledger by ranges, so
+    several crawler processes can share it.
+    """
+
+    def __init__(self, htmls_dir, images_dir, ledger_path, base_url=NPM_URL, concurrency=8,
+                 rate=4.0, retries=3, claim_size=64, claim_timeout=3600):
+        """
+        `concurrency` is the number of pids crawled at once, `rate` the maximum number
+        of requests per second, `retries` the number of retries of a request and
+        `claim_size` the number of pids claimed from the ledger at once. Pids claimed
+        (or started, as they may wait in the queue) more than `claim_timeout` seconds
+        ago and not yet recorded (e.g. by a killed process) are claimed again by other
+        processes, so it must exceed the time to crawl one pid.
+        """
+        self.htmls_dir = htmls_dir
+        self.images_dir = images_dir
+        self.ledger = CrawlLedger(ledger_path)
+        self.worker = f"{socket.gethostname()}-{os.getpid()}"
+        self.base_url = base_url
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate, capacity=concurrency)
+        self.retries = retries
+        self.claim_size = claim_size
+        self.claim_timeout = claim_timeout
+
+    async def request(self, session, url, handle):
+        """
+        Request `url` and return `await handle(response)`, retrying with exponential
+        backoff on connection errors and 429/5xx responses. Other 4xx responses (e.g.
+        403/404) are raised at once.
+        """
+        import aiohttp
+
+        for attempt in range(self.retries + 1):
+            await self.bucket.acquire()
+            try:
+                async with session.get(url) as response:
+                    error = aiohttp.ClientResponseError(
+                        response.request_info, response.history, status=response.status,
+                        message=response.reason or "",
+                    )
+                    if response.status == 429 or response.status >= 500:
+                        raise error
+                    if response.status < 400:
+                        return await handle(response)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt == self.retries:
+                    raise
+                await asyncio.sleep(2**attempt + random.random())
+                continue
+            # not retried, outside of the `except` above
+            raise error
+
+    async def save_image(self, response, pid):
+        """
+        Stream the image to disk, return its file name, size and SHA-256. If the file
+        name is taken (by another pid, maybe of another crawler process), the image is
+        saved as '<pid>_<name>' instead.
+        """
+        name = response.content_disposition and response.content_disposition.filename
+        name = name or unquote(os.path.basename(urlsplit(str(response.url)).path))
+        # a pid is claimed by one worker, so its temporary file isn't shared
+        part_path = os.path.join(self.images_dir, f"{pid}.part")
+        sha256, size = hashlib.sha256(), 0
+        try:
+            with open(part_path, "wb") as f:
+                async for chunk in response.content.iter_chunked(1 << 16):
+                    f.write(chunk)
+                    sha256.update(chunk)
+                    size += len(chunk)
+        except BaseException:
+            os.remove(part_path)
+            raise
+        try:
+            # claim the name atomically, fails if it exists
+            os.link(part_path, os.path.join(self.images_dir, name))
+            os.remove(part_path)
+        except FileExistsError:
+            name = f"{pid}_{name}"
+            os.replace(part_path, os.path.join(self.images_dir, name))
+        return name, size, sha256.hexdigest()
+
+    async def download(self, session, pid):
+        """
+        Save page source (html) first, then download image, finally record the
+        downloaded image info to the ledger.
+        """
+        url = f"{self.base_url}/Painting/Content?pid={pid}&Dept=P"
+        page_source = await self.request(session, url, lambda r: r.text())
+        with open(f"{self.htmls_dir}/{pid}.html", "w") as f:
+            f.write(page_source)
+        dpi = parse_img_dpi(page_source)
+        if dpi is None:
+            self.ledger.record(pid, "none")
+            return
+        img_url = parse_download_url(page_source, dpi, url)
+        img_info = await self.request(session, img_url, lambda r: self.save_image(r, pid))
+        self.ledger.record(pid, "done", dpi, *img_info)
+
+    async def crawl(self, max_pid=MAX_PID):
+        import aiohttp
+
+        queue = asyncio.Queue()
+        failed_n = 0
+
+        async def worker(session):
+            nonlocal failed_n
+            while True:
+                if queue.empty():
+                    pids = self.ledger.claim(
+                        self.claim_size, self.worker, max_pid, self.claim_timeout
+                    )
+                    if pids == []:
+                        return
+                    _ = [queue.put_nowait(pid) for pid in pids]
+                pid = queue.get_nowait()
+                # claimed again by another process while queued
+                if not self.ledger.start(pid, self.worker):
+                    continue
+                try:
+                    await self.download(session, pid)
+                except Exception as e:
+                    print(f"[INFO] Failed to crawl pid {pid}: {e!r}")
+                    self.ledger.record(pid, "failed")
+                    failed_n += 1
+
+        try:
+            async with aiohttp.ClientSession() as session:
+                await asyncio.gather(*[worker(session) for _ in range(self.concurrency)])
+        finally:
+            # pids claimed but not crawled (e.g. interrupted) will be crawled next run,
+            # or after `claim_timeout` if the process is killed before releasing them
+            self.ledger.release(self.worker)
+        print(f"[INFO] {failed_n} pids failed, status counts: {self.ledger.counts()}")
+
+    def run(self, retry_failed=True):
+        """
+        Crawl all the pids not yet in the ledger (previously saved will not be
+        crawled), and the failed pids if `retry_failed` is True.
+        """
+        if retry_failed:
+            self.ledger.release(status="failed")
+        asyncio.run(self.crawl())
+        print("Completed!")
+
+
 def is_normal(images_dir, map_csv_path):
     """
     check if existed images and mapping info are right.
@@ -226,13 +449,25 @@ if __name__ == "__main__":
     htmls_dir = "../data/Chinese-Painting/htmls"
     images_dir = "../data/Chinese-Painting/images"
     map_csv_path = "../data/Chinese-Painting/map.csv"
+    ledger_path = "../data/Chinese-Painting/crawl.sqlite"
     err = "does't exist, please create it or specify another."
-    for path in [htmls_dir, images_dir, map_csv_path]:
+    for path in [htmls_dir, images_dir]:
         if not os.path.exists(path):
             print(f"Error: {path} {err}")
             sys.exit(1)
-    if is_normal(images_dir, map_csv_path) is True:
-        crawler = NPMCrawler(htmls_dir, images_dir, map_csv_path)
-        crawler.run()
-    else:
+    # import the 'map.csv' of a previous `NPMCrawler` run, fixed if it was interrupted
+    if not os.path.exists(ledger_path) and os.path.exists(map_csv_path):
+        fix_map_csv(images_dir, map_csv_path)
+        if is_normal(images_dir, map_csv_path) is not True:
+            sys.exit(1)
+        CrawlLedger(ledger_path).import_map_csv(map_csv_path, images_dir)
+    gaps, missing, extra = CrawlLedger(ledger_path).check(images_dir)
+    if gaps or missing or extra:
+        print(f"Error: images is not equal to {ledger_path}")
+        print("Note:")
+        print("\tpids not in ledger:", gaps)
+        print("\tmissing images:", missing)
+        print("\textra images:", extra)
         sys.exit(1)
+    crawler = AsyncNPMCrawler(htmls_dir, images_dir, ledger_path)
+    crawler.run()
@@ -0,0 +1,94 @@
+# Find near-duplicate crawled images (details, re-photographs, the same scroll at 100
+# and 600 DPI...) by perceptual hash, before resizing and labeling them. Writes the
+# clusters of near-duplicates, and a keep-list with the largest image of each
+# cluster, consumed by `1-resize.py`.
+
+import os
+import csv
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+from algorithms.dedup import BKTree, dhash, hamming, phash
+from utils.io import open_image
+
+
+def hash_image(path):
+    """
+    Return the size, pHash and dHash of an image, decoded at reduced size (JPEG DCT
+    scaling) since the hashes only need 32x32 pixels. Return None if the image can't
+    be decoded (e.g. a truncated download).
+    """
+    try:
+        with open_image(path) as img:
+            size = img.size
+            img.draft("L", (128, 128))
+            gray = img.convert("L")
+            gray.thumbnail((128, 128), Image.Resampling.BILINEAR)
+            phash_ = phash(np.asarray(gray.resize((32, 32), Image.Resampling.LANCZOS)))
+            dhash_ = dhash(np.asarray(gray.resize((9, 8), Image.Resampling.LANCZOS)))
+    except Exception as e:
+        print(f"[INFO] Skipped {path}: {e!r}")
+        return None
+    return size, phash_, dhash_
+
+
+def dedup(images_dir, clusters_path, keep_list_path, max_distance=10, max_dhash_distance=10,
+          workers=None):
+    """
+    Hash the images of `images_dir` across `workers` processes, then cluster them: in
+    name order, an image joins the cluster of the closest representative (the first
+    image of a cluster) whose pHash is within `max_distance` bits and dHash within
+    `max_dhash_distance` bits, else it represents a new cluster. As images are only
+    compared to representatives, a chain of similar images doesn't merge clusters.
+    Write the clusters (csv) and the keep-list (the largest image of each cluster, one
+    name per line). Images which can't be decoded are skipped.
+    """
+    names = sorted(os.listdir(images_dir))
+    paths = [os.path.join(images_dir, name) for name in names]
+    with ProcessPoolExecutor(workers) as executor:
+        hashes = list(executor.map(hash_image, paths, chunksize=16))
+    skipped = [i for i, v in enumerate(hashes) if v is None]
+
+    # the representatives in a BK-tree of their pHash, and the images of their cluster
+    tree = BKTree()
+    clusters = {}
+    for i, hash_ in enumerate(hashes):
+        if hash_ is None:
+            continue
+        _, phash_, dhash_ = hash_
+        # confirmed by dHash, the closest representative
+        matches = [
+            (hamming(phash_, hashes[j][1]) + hamming(dhash_, hashes[j][2]), j)
+            for j in tree.query(phash_, max_distance)
+            if hamming(dhash_, hashes[j][2]) <= max_dhash_distance
+        ]
+        if matches:
+            clusters[min(matches)[1]].append(i)
+        else:
+            tree.add(phash_, i)
+            clusters[i] = [i]
+
+    # keep the image with the most pixels (e.g. 600 DPI over 100 DPI)
+    keeps = {
+        max(cluster, key=lambda i: (hashes[i][0][0] * hashes[i][0][1], -i))
+        for cluster in clusters.values()
+    }
+
+    with open(clusters_path, "w") as f:
+        writer = csv.writer(f)
+        writer.writerow(["cluster", "name", "width", "height", "phash", "dhash", "keep"])
+        for cluster_id, cluster in enumerate(sorted(clusters.values())):
+            for i in cluster:
+                (width, height), phash_, dhash_ = hashes[i]
+                writer.writerow([cluster_id, names[i], width, height, f"{phash_:016x}",
+                                 f"{dhash_:016x}", int(i in keeps)])
+    with open(keep_list_path, "w") as f:
+        f.write("".join(f"{names[i]}\n" for i in sorted(keeps)))
+    print(f"[INFO] Kept {len(keeps)} of {len(names)} images ({len(skipped)} skipped)")
+
+
+if __name__ == "__main__":
+    images_dir = "../data/Chinese-Painting/images"
+    clusters_path = "../data/Chinese-Painting/dedup-clusters.csv"
+    keep_list_path = "../data/Chinese-Painting/dedup-keep.txt"
+    dedup(images_dir, clusters_path, keep_list_path)
@@ -0,0 +1,126 @@
+# Extract the metadata (dynasty, artist, dimensions...) of the paintings from the
+# page HTML saved by `0-crawler.py` to a SQLite table keyed by pid, so subsets like
+# `Chinese-Painting-n240` can be chosen by a query joined with the crawl ledger:
+#
+#   SELECT pid, filename FROM crawl JOIN metadata USING (pid) WHERE dynasty = '宋';
+#
+# Re-runs only parse the HTML files which are new or modified since the last run.
+
+import os
+import re
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+import lxml.html
+
+# metadata column: label of the field in the page (matched as a prefix,
+# e.g. '尺寸' matches '尺寸(公分)：')
+FIELDS = {
+    "title": "品名",
+    "artist": "作者",
+    "dynasty": "朝代",
+    "material": "質地",
+    "dimensions": "尺寸",
+    "accession_number": "統一編號",
+}
+# the pages are saved as utf-8 by `0-crawler.py`
+_PARSER = lxml.html.HTMLParser(encoding="utf-8")
+
+
+def _starts_with_label(text):
+    return any(text.startswith(label) for label in FIELDS.values())
+
+
+def _text_segments(el):
+    """
+    The text of an element split at each `<br>` and each child starting with a label,
+    so that `<div>品名：...<br/>作者：...</div>` gives one segment per field.
+    """
+    segments, segment = [], el.text or ""
+    for child in el:
+        # comments and processing instructions only contribute their tail
+        text = child.text_content() if isinstance(child.tag, str) else ""
+        if child.tag == "br" or _starts_with_label(text.strip()):
+            segments.append(segment)
+            segment = ""
+        else:
+            segment += text
+        segment += child.tail or ""
+    return segments + [segment]
+
+
+def parse_metadata(html_path):
+    """
+    Get the fields of a page: the text following each label up to the next label or
+    `<br>`, either in the same element (`<li>作者：...</li>`, `<p>品名：...<br/>作者：
+    ...</p>`) or in the label's next sibling element (`<th>作者</th><td>...</td>`).
+    """
+    metadata = dict.fromkeys(FIELDS)
+    with open(html_path, "rb") as f:
+        content = f.read()
+    if content.strip() == b"":
+        return metadata
+    doc = lxml.html.fromstring(content, parser=_PARSER)
+    for el in doc.iter("th", "td", "dt", "dd", "li", "span", "label", "div", "p"):
+        segments = _text_segments(el)
+        for segment in segments:
+            text = segment.strip()
+            for field, label in FIELDS.items():
+                if metadata[field] is not None or not text.startswith(label):
+                    continue
+                # drop the label, its unit like '(公分)' and its colon
+                value = re.sub(r"^\s*[(（][^)）]*[)）]", "", text[len(label):])
+                value = value.lstrip("：: \t\n").strip()
+                sibling = el.getnext()
+                if value == "" and len(segments) == 1 and sibling is not None:
+                    value = sibling.text_content().strip()
+                metadata[field] = value or None
+    return metadata
+
+
+def _parse_job(pid, html_path, mtime):
+    return pid, mtime, parse_metadata(html_path)
+
+
+def extract_metadata(htmls_dir, db_path, workers=None, chunksize=64):
+    """
+    Parse the `{pid}.html` of `htmls_dir` across `workers` processes (default: the
+    number of CPUs) into the `metadata` table of `db_path`, which can be the crawl
+    ledger. Pages whose modification time is not newer than the last run are skipped.
+    """
+    conn = sqlite3.connect(db_path, timeout=60)
+    conn.execute("PRAGMA journal_mode=WAL")
+    columns = ", ".join(f"{i} TEXT" for i in FIELDS)
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS metadata (pid INTEGER PRIMARY KEY, "
+        f"html_mtime REAL, {columns})"
+    )
+    parsed = dict(conn.execute("SELECT pid, html_mtime FROM metadata"))
+    jobs = []
+    for entry in os.scandir(htmls_dir):
+        pid = entry.name.split(".")[0]
+        if not (entry.name.endswith(".html") and pid.isdigit()):
+            continue
+        mtime = entry.stat().st_mtime
+        if mtime > parsed.get(int(pid), -1):
+            jobs.append((int(pid), entry.path, mtime))
+    print(f"[INFO] Parsing {len(jobs)} pages ({len(parsed)} already parsed)")
+
+    sql = (
+        f"INSERT OR REPLACE INTO metadata (pid, html_mtime, {', '.join(FIELDS)}) "
+        f"VALUES ({', '.join('?' * (len(FIELDS) + 2))})"
+    )
+    with ProcessPoolExecutor(workers) as executor:
+        rows = executor.map(_parse_job, *zip(*jobs), chunksize=chunksize) if jobs else []
+        for i, (pid, mtime, metadata) in enumerate(rows, start=1):
+            conn.execute(sql, (pid, mtime, *metadata.values()))
+            if i % 1000 == 0:
+                conn.commit()
+                print(f"[INFO] Parsed {i}/{len(jobs)} pages")
+    conn.commit()
+    conn.close()
+
+
+if __name__ == "__main__":
+    htmls_dir = "../data/Chinese-Painting/htmls"
+    ledger_path = "../data/Chinese-Painting/crawl.sqlite"
+    extract_metadata(htmls_dir, ledger_path)
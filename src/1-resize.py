@@ -1,34 +1,176 @@
 # Date: 2024/4/13
 import os
-from torchvision import transforms
-from torchvision.io import read_image, write_png
+import csv
+import random
+from itertools import groupby
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from PIL import Image
+from utils.io import open_image, raw_tiff_chunks, read_tiff_chunk
 
 
-def resize_image_to_800(ori_path, tar_path):
+def _resized_size(w, h, size):
+    """Size with the shorter side resized to `size`, like `transforms.Resize(size)`."""
+    short, long = (w, h) if w <= h else (h, w)
+    new_short, new_long = size, int(size * long / short)
+    return (new_short, new_long) if w <= h else (new_long, new_short)
+
+
+def _box_reduce(rows, factor_x):
+    """Average the blocks of `factor_x` columns of rows already averaged (float32)."""
+    w = rows.shape[1]
+    n = w // factor_x * factor_x
+    main = rows[:, :n].reshape(rows.shape[0], -1, factor_x, 3).mean(2)
+    if n == w:
+        return main
+    # the last partial block, like `Image.reduce`
+    return np.concatenate([main, rows[:, n:].mean(1, keepdims=True)], 1)
+
+
+def read_tiff_reduced(ori_path, chunks, factor_x, factor_y):
+    """
+    Read an uncompressed TIFF as RGB reduced by `(factor_x, factor_y)` (box average,
+    like `Image.reduce`), decoding a band of strips/tiles at a time: the full
+    resolution image is never materialized.
+    """
+    with open_image(ori_path) as image, open(ori_path, "rb") as f:
+        mode, rawmode, (w, h) = image.mode, image.tile[0][3][0], image.size
+        reduced = np.zeros((-(-h // factor_y), -(-w // factor_x), 3), dtype=np.uint8)
+        reduced_y, carry = 0, np.zeros((0, w, 3), dtype=np.float32)
+        for y, row in groupby(chunks, key=lambda c: c[1]):
+            row = list(row)
+            band = np.zeros((min(row[0][3], h - y), w, 3), dtype=np.float32)
+            for chunk in row:
+                x = chunk[0]
+                pixels = read_tiff_chunk(f, mode, rawmode, chunk)[:band.shape[0], :w - x]
+                band[:, x:x + pixels.shape[1]] = pixels
+            # the rows left over by the previous band, less than `factor_y`
+            carry = np.concatenate([carry, band])
+            n = carry.shape[0] // factor_y * factor_y
+            rows = _box_reduce(carry[:n].reshape(-1, factor_y, w, 3).mean(1), factor_x)
+            reduced[reduced_y:reduced_y + len(rows)] = rows.round()
+            reduced_y, carry = reduced_y + len(rows), carry[n:]
+        # the last partial block of rows
+        if carry.shape[0] > 0:
+            reduced[reduced_y] = _box_reduce(carry.mean(0, keepdims=True), factor_x).round()
+    return Image.fromarray(reduced)
+
+
+def read_image_shrunk(ori_path, size):
+    """
+    Read an image as RGB with its shorter side resized to `size` (the longer side
+    keeps the ratio, like `torchvision.transforms.Resize(size)`), shrinking on load:
+    JPEG is decoded with DCT scaling, uncompressed TIFF is reduced strip by strip (see
+    `read_tiff_reduced`), then the image is reduced by an integer factor before the
+    final antialiased bilinear resize. So the full resolution buffer of JPEG and
+    uncompressed TIFF is never materialized (other formats are decoded fully).
+    """
+    image = open_image(ori_path)
+    new_size = _resized_size(*image.size, size)
+    # keep at least twice the target size for the reduce + resize below
+    factor_x = max(image.size[0] // (new_size[0] * 2), 1)
+    factor_y = max(image.size[1] // (new_size[1] * 2), 1)
+    chunks = raw_tiff_chunks(image)
+    if chunks is not None:
+        image.close()
+        image = read_tiff_reduced(ori_path, chunks, factor_x, factor_y)
+        return image.resize(new_size, Image.Resampling.BILINEAR)
+    image.draft("RGB", (new_size[0] * 2, new_size[1] * 2))
+    # e.g. CMYK scans, palette images must be converted before the resize
+    image = image.convert("RGB")
+    return image.resize(new_size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+
+
+def resize_image_to_800(ori_path, tar_path, size=800):
     """
     Resize an image to 800x800 pixels. If the original image's width is greater
-    than its height, resize the height to 800 while maintaining the original 
-    width-to-height ratio. Then randomly crop an 800x800 window as the target 
+    than its height, resize the height to 800 while maintaining the original
+    width-to-height ratio. Then randomly crop an 800x800 window as the target
     image. The same applies vice versa. e.g. 10000x8000 => 1000x800 => 800x800.
     """
-    trans = transforms.Compose(
-        [transforms.Resize(size=800), transforms.RandomCrop(size=800)]
-    )
-    image = read_image(ori_path)
-    image_resized = trans(image)
-    write_png(image_resized, tar_path)
+    image_resized = read_image_shrunk(ori_path, size)
+    w, h = image_resized.size
+    x, y = random.randint(0, w - size), random.randint(0, h - size)
+    image_resized.crop((x, y, x + size, y + size)).save(tar_path, format="PNG")
+
 
+def read_image_names(ori_root, keep_list_path=None):
+    """Names of the images of `ori_root`, only those of the keep-list if given."""
+    image_names = sorted(os.listdir(ori_root))
+    if keep_list_path is not None:
+        with open(keep_list_path) as f:
+            keeps = set(f.read().split("\n"))
+        image_names = [name for name in image_names if name in keeps]
+    return image_names
 
-def resize_based_dir(ori_root, tar_root):
+
+def resize_based_dir(ori_root, tar_root, workers=None, keep_list_path=None):
+    """
+    Resize all the images of `ori_root` across `workers` processes (default: the number
+    of CPUs). Each process holds one image at a time, so memory is bounded by the
+    number of workers. If `keep_list_path` is given (see `0-dedup.py`), only the
+    images of the keep-list are resized.
+    """
     os.makedirs(tar_root)
-    image_names = os.listdir(ori_root)
+    image_names = read_image_names(ori_root, keep_list_path)
     ori_paths = [os.path.join(ori_root, name) for name in image_names]
     tar_paths = [os.path.join(tar_root, name) for name in image_names]
-    for ori, tar in zip(ori_paths, tar_paths):
-        resize_image_to_800(ori, tar)
+    with ProcessPoolExecutor(workers) as executor:
+        _ = list(executor.map(resize_image_to_800, ori_paths, tar_paths))
+
+
+def resize_image_pyramid(ori_path, tar_paths, seed=0):
+    """
+    Resize an image to several sizes (`tar_paths` maps size to target path) like
+    `resize_image_to_800`, from one decode: each size is resized from the previous
+    larger one. The crop window is seeded by `seed` and the image name, and has the
+    same relative location at every size. Return the crops `(size, x, y)`.
+    """
+    rng = random.Random(f"{seed}_{os.path.basename(ori_path)}")
+    fx, fy = rng.random(), rng.random()
+    sizes = sorted(tar_paths, reverse=True)
+    with open_image(ori_path) as image:
+        ori_size = image.size
+    image_resized = read_image_shrunk(ori_path, sizes[0])
+    crops = []
+    for size in sizes:
+        new_size = _resized_size(*ori_size, size)
+        if new_size != image_resized.size:
+            image_resized = image_resized.resize(new_size, Image.Resampling.BILINEAR)
+        w, h = new_size
+        x, y = round(fx * (w - size)), round(fy * (h - size))
+        image_resized.crop((x, y, x + size, y + size)).save(tar_paths[size], format="PNG")
+        crops.append((size, x, y))
+    return crops
+
+
+def resize_based_dir_pyramid(ori_root, tar_root, sizes, seed=0, workers=None,
+                             keep_list_path=None):
+    """
+    Resize all the images of `ori_root` (of the keep-list if given) to each of `sizes`
+    with one decode per image (see `resize_image_pyramid`), across `workers`
+    processes. Images of each size are saved to `{tar_root}-s{size}`, and listed in
+    the csv manifest `{tar_root}-manifest.csv`.
+    """
+    tar_roots = {size: f"{tar_root}-s{size}" for size in sizes}
+    _ = [os.makedirs(i) for i in tar_roots.values()]
+    image_names = read_image_names(ori_root, keep_list_path)
+    ori_paths = [os.path.join(ori_root, name) for name in image_names]
+    tar_paths = [
+        {size: os.path.join(root, name) for size, root in tar_roots.items()}
+        for name in image_names
+    ]
+    with ProcessPoolExecutor(workers) as executor, open(f"{tar_root}-manifest.csv", "w") as f:
+        writer = csv.writer(f)
+        writer.writerow(["source", "size", "x", "y", "output"])
+        seeds = [seed] * len(ori_paths)
+        crops_multi = executor.map(resize_image_pyramid, ori_paths, tar_paths, seeds)
+        for ori, tar, crops in zip(ori_paths, tar_paths, crops_multi):
+            writer.writerows([(ori, size, x, y, tar[size]) for size, x, y in crops])
 
 
 if __name__ == "__main__":
     ori_root = "../data/Chinese-Painting-n240"
-    tar_root = "../data/Chinese-Painting-n240-s800"
-    resize_based_dir(ori_root, tar_root)
+    tar_root = "../data/Chinese-Painting-n240"  # => Chinese-Painting-n240-s{size}
+    keep_list_path = "../data/Chinese-Painting/dedup-keep.txt"
+    resize_based_dir_pyramid(ori_root, tar_root, sizes=[640, 800], keep_list_path=keep_list_path)
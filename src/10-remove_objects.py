@@ -0,0 +1,105 @@
+# Remove the seals/inscriptions predicted by `9-batch_inference.py` from the full
+# resolution paintings, by inpainting only the crops around them with LaMa kept in
+# process (instead of running lama's `bin/predict.py` over whole images, see
+# `8-inpainting.md`). Needs the lama repo in `PYTHONPATH`.
+#
+# `--benchmark N` compares the crop-local and the whole-image inpainting on the first N
+# paintings instead.
+
+import os
+import json
+import time
+import argparse
+import numpy as np
+from pycocotools import mask as mask_utils
+from scipy import ndimage
+from utils.inpainting import CropInpainter, LamaInpainter, inpaint_whole
+from utils.io import read_image_rgb, write_png
+
+
+def read_predictions(predictions_path):
+    """
+    Yield the file name, union mask and bboxes (`XYWH`) of each predicted image
+    (skipping the ones which couldn't be decoded).
+    """
+    with open(predictions_path) as f:
+        for line in f:
+            record = json.loads(line)
+            if "error" in record:
+                continue  # couldn't be decoded
+            rles = [i["segmentation"] for i in record["instances"]]
+            if rles == []:
+                mask = np.zeros((record["height"], record["width"]), dtype=bool)
+            else:
+                mask = mask_utils.decode(mask_utils.merge(rles, intersect=False)).astype(bool)
+            yield record["file_name"], mask, [i["bbox"] for i in record["instances"]]
+
+
+def remove_objects(img_dir, predictions_path, output_dir, model_dir, pad=128, dilation=7,
+                   feather=16, batch_size=4):
+    """
+    Inpaint the predicted objects of the paintings of `img_dir` (see `CropInpainter`)
+    and save the cleaned paintings to `output_dir`, skipping the ones already saved.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    inpainter = CropInpainter(LamaInpainter(model_dir), pad, dilation, feather, batch_size)
+    for img_name, mask, boxes in read_predictions(predictions_path):
+        output_path = os.path.join(output_dir, img_name.split(".")[0] + ".png")
+        if os.path.exists(output_path):
+            continue
+        img = read_image_rgb(os.path.join(img_dir, img_name))
+        start = time.perf_counter()
+        cleaned = inpainter(img, mask, boxes) if boxes != [] else img
+        write_png(output_path, cleaned)
+        print(f"[INFO] Removed {len(boxes)} objects from {img_name} "
+              f"in {time.perf_counter() - start:.2f}s")
+
+
+def benchmark(img_dir, predictions_path, model_dir, n=10, pad=128, dilation=7, feather=16,
+              batch_size=4):
+    """
+    Time the crop-local inpainting against the whole-image one on the first `n`
+    predicted paintings with objects, and compare their results in the masks.
+    """
+    lama = LamaInpainter(model_dir)
+    inpainter = CropInpainter(lama, pad, dilation, feather, batch_size)
+    crop_time, whole_time, crop_pixels, whole_pixels, diffs = 0, 0, 0, 0, []
+    predictions = (i for i in read_predictions(predictions_path) if i[2] != [])
+    for _, (img_name, mask, boxes) in zip(range(n), predictions):
+        img = read_image_rgb(os.path.join(img_dir, img_name))
+        start = time.perf_counter()
+        cleaned_crop = inpainter(img, mask, boxes)
+        crop_time += time.perf_counter() - start
+        dilated = ndimage.binary_dilation(mask, iterations=dilation)
+        start = time.perf_counter()
+        cleaned_whole = inpaint_whole(lama, img, dilated)
+        whole_time += time.perf_counter() - start
+        img_h, img_w = img.shape[:2]
+        crop_pixels += sum(h * w for _, _, h, w in inpainter.crops(img_h, img_w, boxes))
+        whole_pixels += img_h * img_w
+        diff = np.abs(cleaned_crop.astype(np.int16) - cleaned_whole)[dilated]
+        diffs.append(diff.mean())
+        print(f"[INFO] {img_name}: crops {crop_time:.2f}s, whole {whole_time:.2f}s (so far)")
+    print(f"[INFO] crop-local: {crop_time:.2f}s, {crop_pixels / 1e6:.1f} MP inpainted")
+    print(f"[INFO] whole-image: {whole_time:.2f}s, {whole_pixels / 1e6:.1f} MP inpainted")
+    print(f"[INFO] speedup {whole_time / crop_time:.1f}x, mean abs difference in the masks "
+          f"{np.mean(diffs):.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Remove the predicted seals/inscriptions.")
+    parser.add_argument("img_dir")
+    parser.add_argument("--predictions", default="./output/predictions.jsonl")
+    parser.add_argument("--output-dir", default="./output/cleaned")
+    parser.add_argument("--model-dir", default="./lama/big-lama")
+    parser.add_argument("--pad", type=int, default=128)
+    parser.add_argument("--dilation", type=int, default=7)
+    parser.add_argument("--feather", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--benchmark", type=int, default=None, metavar="N")
+    args = parser.parse_args()
+    options = (args.pad, args.dilation, args.feather, args.batch_size)
+    if args.benchmark is None:
+        remove_objects(args.img_dir, args.predictions, args.output_dir, args.model_dir, *options)
+    else:
+        benchmark(args.img_dir, args.predictions, args.model_dir, args.benchmark, *options)
@@ -0,0 +1,227 @@
+# Remove the seals/inscriptions of paintings end to end in one process, with the
+# detectron2 model (`9-batch_inference.py`) and the LaMa model (`10-remove_objects.py`)
+# kept loaded. Each image goes through the stages
+#
+#   decode -> detect -> mask -> inpaint -> encode
+#
+# run by threads connected by bounded queues, so a slow stage blocks the ones before it
+# instead of piling up images in memory. Either clean a directory (`run`, optionally
+# watching it for new images), or serve a local HTTP endpoint (`serve`):
+#
+#   curl --data-binary @painting.jpg localhost:8000/remove > cleaned.png
+#   curl localhost:8000/stats
+#
+# The latency of each stage (and end to end) is reported by `/stats` and by `run`.
+
+import io
+import os
+import json
+import time
+import queue
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from PIL import Image
+from pycocotools import mask as mask_utils
+from utils.inference import BatchPredictor, encode_instances, get_inference_cfg
+from utils.inpainting import CropInpainter, LamaInpainter
+from utils.tiled_inference import TiledPredictor
+
+STAGES = ["decode", "detect", "mask", "inpaint", "encode"]
+
+
+class RemovalPipeline:
+    """
+    Stages run by threads connected by queues of `queue_size` images. `detector` takes
+    an RGB image and returns COCO-style results (like `TiledPredictor`), `inpainter`
+    takes the image, the mask and the bboxes (like `CropInpainter`). The models are
+    used by one thread each, decoding and encoding by `io_workers` threads each.
+    """
+
+    def __init__(self, detector, inpainter, queue_size=4, io_workers=2, output_format="PNG",
+                 latency_window=1000) -> None:
+        self.detector = detector
+        self.inpainter = inpainter
+        self.output_format = output_format
+        # the inbox of each stage
+        self.queues = [queue.Queue(queue_size) for _ in STAGES]
+        # the latencies (s) of the last `latency_window` images, by stage
+        self.latencies = {i: deque(maxlen=latency_window) for i in STAGES + ["total"]}
+        self.threads = []
+        stage_fns = [self._decode, self._detect, self._mask, self._inpaint, self._encode]
+        stage_workers = [io_workers, 1, 1, 1, io_workers]
+        for i, (fn, workers) in enumerate(zip(stage_fns, stage_workers)):
+            for _ in range(workers):
+                thread = threading.Thread(target=self._run_stage, args=(i, fn), daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def submit(self, data: bytes) -> Future:
+        """
+        Queue an encoded image (blocks while the first queue is full). Return a future of
+        the encoded cleaned image.
+        """
+        job = {"data": data, "future": Future(), "submitted": time.perf_counter()}
+        self.queues[0].put(job)
+        return job["future"]
+
+    def _run_stage(self, i, fn):
+        while True:
+            job = self.queues[i].get()
+            start = time.perf_counter()
+            try:
+                fn(job)
+            except Exception as e:
+                job["future"].set_exception(e)
+                continue
+            end = time.perf_counter()
+            self.latencies[STAGES[i]].append(end - start)
+            if i + 1 < len(STAGES):
+                self.queues[i + 1].put(job)
+            else:
+                self.latencies["total"].append(end - job["submitted"])
+                job["future"].set_result(job.pop("output"))
+
+    def _decode(self, job):
+        with Image.open(io.BytesIO(job.pop("data"))) as img:
+            job["img"] = np.asarray(img.convert("RGB"))
+
+    def _detect(self, job):
+        job["instances"] = self.detector(job["img"])
+
+    def _mask(self, job):
+        instances = job.pop("instances")
+        job["boxes"] = [i["bbox"] for i in instances]
+        rles = [i["segmentation"] for i in instances]
+        if rles != []:
+            job["mask"] = mask_utils.decode(mask_utils.merge(rles, intersect=False)).astype(bool)
+
+    def _inpaint(self, job):
+        if job["boxes"] != []:
+            job["img"] = self.inpainter(job["img"], job.pop("mask"), job["boxes"])
+
+    def _encode(self, job):
+        output = io.BytesIO()
+        Image.fromarray(job.pop("img")).save(output, format=self.output_format)
+        job["output"] = output.getvalue()
+
+    def stats(self) -> dict:
+        """Number of images, mean, median and 95th percentile latency (ms) by stage."""
+        stats = {}
+        for stage, latencies in self.latencies.items():
+            latencies = np.array(latencies) * 1000
+            if latencies.size == 0:
+                stats[stage] = {"n": 0}
+                continue
+            stats[stage] = {
+                "n": int(latencies.size),
+                "mean_ms": round(float(latencies.mean()), 1),
+                "p50_ms": round(float(np.percentile(latencies, 50)), 1),
+                "p95_ms": round(float(np.percentile(latencies, 95)), 1),
+            }
+        return stats
+
+
+def load_pipeline(weights, model_dir, tile=800, tile_overlap=200, batch_size=4,
+                  score_thresh=0.7, pad=128, dilation=7, feather=16, queue_size=4):
+    """The pipeline with the trained detectron2 model and LaMa loaded."""
+    predictor = BatchPredictor(get_inference_cfg(weights, score_thresh))
+    if tile is None:
+        def detector(img):
+            return encode_instances(predictor([predictor.prepare(img)])[0])
+    else:
+        detector = TiledPredictor(predictor, tile, tile_overlap, batch_size)
+    inpainter = CropInpainter(LamaInpainter(model_dir), pad, dilation, feather, batch_size)
+    return RemovalPipeline(detector, inpainter, queue_size)
+
+
+def run(pipeline, input_dir, output_dir, watch=False, interval=10):
+    """
+    Clean the images of `input_dir` to `output_dir` (as PNG), skipping the ones already
+    cleaned. If `watch` is True, keep looking for new images every `interval` seconds.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    submitted, pending = set(), deque()
+
+    def write_done(block):
+        # write the cleaned images in submission order, as they're done
+        while pending and (block or pending[0][1].done()):
+            output_path, future = pending.popleft()
+            if future.exception() is not None:
+                print(f"[INFO] Failed to clean {output_path}: {future.exception()}")
+                continue
+            with open(output_path + ".part", "wb") as f:
+                f.write(future.result())
+            os.replace(output_path + ".part", output_path)
+
+    while True:
+        for img_name in sorted(os.listdir(input_dir)):
+            output_path = os.path.join(output_dir, img_name.split(".")[0] + ".png")
+            if img_name in submitted or os.path.exists(output_path):
+                continue
+            submitted.add(img_name)
+            with open(os.path.join(input_dir, img_name), "rb") as f:
+                pending.append((output_path, pipeline.submit(f.read())))
+            write_done(block=False)
+        write_done(block=True)
+        print(f"[INFO] Processed {len(submitted)} images, latency: {json.dumps(pipeline.stats())}")
+        if not watch:
+            break
+        time.sleep(interval)
+
+
+def serve(pipeline, host="127.0.0.1", port=8000):
+    """Serve `POST /remove` (image in, cleaned PNG out) and `GET /stats`."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, code, content_type, body):
+            self.send_response(code)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            if self.path != "/remove":
+                return self.send_error(404)
+            data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            try:
+                output = pipeline.submit(data).result()
+            except Exception as e:
+                return self._send(400, "text/plain", str(e).encode())
+            self._send(200, "image/png", output)
+
+        def do_GET(self):
+            if self.path != "/stats":
+                return self.send_error(404)
+            self._send(200, "application/json", json.dumps(pipeline.stats()).encode())
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    print(f"[INFO] Serving on http://{host}:{port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seal/inscription removal service.")
+    parser.add_argument("--weights", default="./output/model_final.pth")
+    parser.add_argument("--model-dir", default="./lama/big-lama")
+    parser.add_argument("--tile", type=int, default=800, help="0 to predict whole images")
+    parser.add_argument("--queue-size", type=int, default=4)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="clean a directory")
+    run_parser.add_argument("input_dir")
+    run_parser.add_argument("output_dir")
+    run_parser.add_argument("--watch", action="store_true")
+    serve_parser = subparsers.add_parser("serve", help="serve a local HTTP endpoint")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    pipeline = load_pipeline(args.weights, args.model_dir, tile=args.tile or None,
+                             queue_size=args.queue_size)
+    if args.command == "run":
+        run(pipeline, args.input_dir, args.output_dir, args.watch)
+    else:
+        serve(pipeline, args.host, args.port)
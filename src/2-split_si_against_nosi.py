@@ -1,47 +1,90 @@
 # Date: 2024/4/15
 import os
+import csv
+import fcntl
 import shutil
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from os.path import join
 from pathlib import Path
-from pycocotools.coco import COCO
+from utils.bbox_mask import AnnotationIndex
+
+# ioctl request to clone a file's extents on Linux (btrfs, xfs...), see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+
+def reflink(src, dst):
+    """Copy `src` to `dst` by reflink (copy-on-write clone), else by a normal copy."""
+    try:
+        with open(src, "rb") as f_src, open(dst, "wb") as f_dst:
+            fcntl.ioctl(f_dst.fileno(), FICLONE, f_src.fileno())
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+MATERIALIZE_FNS = {
+    "copy": shutil.copy,
+    "hardlink": os.link,
+    "symlink": lambda src, dst: os.symlink(os.path.abspath(src), dst),
+    "reflink": reflink,
+}
+
+
+def is_train(name, split_ratio, seed=0):
+    """
+    Whether an image goes to train, decided by the hash of its name and `seed`, so
+    the split of an image never changes when other images are added.
+    """
+    digest = hashlib.sha256(f"{seed}_{name}".encode()).digest()
+    return int.from_bytes(digest[:8], "big") / 2**64 < split_ratio
 
 
 def split_si_against_nosi(
-    images_dir, coco_json_path, output_si_dir, output_nosi_dir, split_ratio
+    images_dir, coco_json_path, output_si_dir, output_nosi_dir, split_ratio,
+    mode="copy", seed=0, manifest_path=None, workers=8,
 ):
     """
     Split images to two kinds: have seals/inscriptions or don't have (si VS nosi).
-    `split_ratio` is the train:val ratio of the nosi data.
+    `split_ratio` is the train:val ratio of the nosi data (approximately, as each image
+    is assigned by the hash of its name and `seed`).
+
+    `mode` is how images are materialized in the output directories: 'copy',
+    'hardlink', 'symlink', 'reflink' (falls back to copy if unsupported), or
+    'manifest' (only write the manifest). The manifest (csv of source, split) is
+    written to `manifest_path` if given. Files are materialized by `workers` threads.
     """
-    ## Load annotations json
-    coco = COCO(coco_json_path)
+    if mode != "manifest" and mode not in MATERIALIZE_FNS:
+        raise ValueError(f"Argument 'mode' must be in {list(MATERIALIZE_FNS)} or 'manifest'.")
+    if mode == "manifest" and manifest_path is None:
+        raise ValueError("Argument 'manifest_path' is needed in 'manifest' mode.")
+    ## Load annotations index
+    index = AnnotationIndex.from_coco_json(coco_json_path)
     # Get filenames of two kinds images
-    images_id_path_dic = {
-        v["id"]: Path(images_dir) / Path(v["file_name"]).name
-        for v in coco.imgs.values()
-    }
-    # si path dic
-    images_id_which_has_si = set([v["image_id"] for v in coco.anns.values()])
-    images_path_si = [images_id_path_dic[i] for i in images_id_which_has_si]
-    # nosi path dic
-    images_id_which_has_no_si = set(images_id_path_dic.keys()) - images_id_which_has_si
-    images_path_nosi = [images_id_path_dic[i] for i in images_id_which_has_no_si]
+    images_path_si = [Path(images_dir) / i for i in index.names_with_anns]
+    images_path_nosi = [Path(images_dir) / i for i in index.names if not index.has_anns(i)]
+    # Assign each image to its split
+    splits = [(i, "si", Path(output_si_dir)) for i in images_path_si]
+    for i in images_path_nosi:
+        split = "train" if is_train(i.name, split_ratio, seed) else "val"
+        splits.append((i, split, Path(output_nosi_dir) / split))
+    if manifest_path is not None:
+        with open(manifest_path, "w") as f:
+            writer = csv.writer(f)
+            writer.writerow(["source", "split"])
+            writer.writerows([(str(i), split) for i, split, _ in splits])
+    if mode == "manifest":
+        return None
     # Make dirtories to save them
     os.makedirs(output_si_dir)
     os.makedirs(output_nosi_dir)
     os.makedirs(join(output_nosi_dir, "train"))
     os.makedirs(join(output_nosi_dir, "val"))
-    # Do copy & paste
-    _ = [shutil.copy(i, Path(output_si_dir) / i.name) for i in images_path_si]
-    train_num = int(len(images_path_nosi) * split_ratio)
-    for i in ["train", "val"]:
-        paths = (
-            images_path_nosi[:train_num]
-            if i == "train"
-            else images_path_nosi[train_num:]
-        )
-        for j in paths:
-            shutil.copy(j, Path(output_nosi_dir) / i / j.name)
+    # Do copy (link) & paste
+    materialize = MATERIALIZE_FNS[mode]
+    with ThreadPoolExecutor(workers) as executor:
+        futures = [executor.submit(materialize, i, dir_ / i.name) for i, _, dir_ in splits]
+        _ = [i.result() for i in futures]
+    return None
 
 
 if __name__ == "__main__":
@@ -50,5 +93,6 @@ if __name__ == "__main__":
     output_si_dir = "../data/Chinese-Painting-s800-si"
     output_nosi_dir = "../data/Chinese-Painting-s800-nosi"
     split_si_against_nosi(
-        images_dir, coco_json_path, output_si_dir, output_nosi_dir, split_ratio=0.7
+        images_dir, coco_json_path, output_si_dir, output_nosi_dir, split_ratio=0.7,
+        mode="reflink",
     )
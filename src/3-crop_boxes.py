@@ -1,11 +1,30 @@
 # Date: 2024/4/15
 import os
+import csv
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from utils.io import read_image, write_png
-from utils.bbox_mask import get_boxes_dic
+from utils.io import read_image_regions, write_png
+from utils.bbox_mask import AnnotationIndex
 
 
-def crop_boxes(img_dir, coco_json_path, output_dir, ann="both"):
+def crop_image_boxes(file, boxes, output_dir):
+    """
+    Crop the boxes `[(obj, i, (x, y, width, height)), ...]` of an image, decoding it
+    once, and save them. Return the manifest rows `(source, x, y, width, height,
+    output)` of the crops.
+    """
+    regions = [box for _, _, box in boxes]
+    rows = []
+    for (obj, i, box), img_box in zip(boxes, read_image_regions(file, regions)):
+        filename = f"{Path(file).name.split('.')[0]}_{obj}_{i+1}.png"
+        output_path = str(Path(output_dir) / filename)
+        write_png(output_path, img_box)
+        rows.append((file, *box, output_path))
+    return rows
+
+
+def crop_boxes(img_dir, coco_json_path, output_dir, ann="both", manifest_path=None,
+               workers=None):
     """
     Crop image's seals/inscriptions boxes and save them to new images.
 
@@ -13,22 +32,33 @@ def crop_boxes(img_dir, coco_json_path, output_dir, ann="both"):
     will be named as `{original_image_name}_seals(or incriptions)_1.png`. `ann`
     indicates the kind of objects to be cropped. Can be 'seal', 'inscription', or
     'both'.
+
+    Images are cropped across `workers` processes (default: the number of CPUs), and
+    the crops are listed in a csv manifest (default: `{output_dir}-manifest.csv`).
     """
     os.makedirs(output_dir)
-    boxes_dic = get_boxes_dic(coco_json_path)
-    for k, v in boxes_dic.items():
+    if manifest_path is None:
+        manifest_path = f"{str(output_dir).rstrip(os.sep)}-manifest.csv"
+    index = AnnotationIndex.from_coco_json(coco_json_path)
+    if ann == "both":
+        objs = ["seals", "inscriptions"]
+    else:
+        objs = [ann + "s"]
+    jobs = []
+    for k in index.names_with_anns:
         file = str(Path(img_dir) / k)
-        if ann == "both":
-            objs = ["seals", "inscriptions"]
-        else:
-            objs = [ann + "s"]
-        for obj in objs:
-            img = read_image(file)
-            for i in range(len(v[obj])):
-                x, y, width, height = [int(i) for i in v[obj][i]]
-                box = img[y : y + height, x : x + width, ...]
-                filename = f"{Path(file).name.split('.')[0]}_{obj}_{i+1}.png"
-                write_png(str(Path(output_dir) / filename), box)
+        boxes = [
+            (obj, i, tuple(int(j) for j in box))
+            for obj in objs
+            for i, box in enumerate(index.boxes(k, obj).astype(int))
+        ]
+        if boxes != []:
+            jobs.append((file, boxes, output_dir))
+    with ProcessPoolExecutor(workers) as executor, open(manifest_path, "w") as f:
+        writer = csv.writer(f)
+        writer.writerow(["source", "x", "y", "width", "height", "output"])
+        for rows in executor.map(crop_image_boxes, *zip(*jobs)):
+            writer.writerows(rows)
 
 
 if __name__ == "__main__":
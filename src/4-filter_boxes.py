@@ -1,26 +1,67 @@
 import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 from algorithms.filter import auto_filter_seal_ins
 from utils.io import read_image, write_png
 
 
-def filter_boxes(boxes_dir, output_dir):
+def is_up_to_date(input_path, output_path):
+    """Whether the output exists and is newer than its input."""
+    return (
+        os.path.exists(output_path)
+        and os.path.getmtime(output_path) >= os.path.getmtime(input_path)
+    )
+
+
+def filter_boxes(boxes_dir, output_dir, incremental=False, fast=False, workers=None,
+                 io_workers=8, queue_size=64):
     """
     Loads all the images from the input boxes directory and auto processes filter
     function based on the object's type. Then saves these newly generated images to the
     output directory.
+
+    Boxes are read by `io_workers` threads, filtered by `workers` processes (default:
+    the number of CPUs) and written by `io_workers` threads, each stage holding at most
+    `queue_size` boxes. If `incremental` is True, `output_dir` may already exist and
+    boxes whose output is newer than the box are skipped. `fast` is passed to
+    `auto_filter_seal_ins`.
     """
-    os.makedirs(output_dir)
-    img_paths = [Path(boxes_dir) / i for i in os.listdir(boxes_dir)]
-    for img_path in img_paths:
+    os.makedirs(output_dir, exist_ok=incremental)
+    jobs = []
+    for img_path in sorted(Path(boxes_dir) / i for i in os.listdir(boxes_dir)):
         output_path = Path(output_dir) / (img_path.name.split(".")[0] + "_filtered.png")
-        img = read_image(img_path)
+        if incremental and is_up_to_date(img_path, output_path):
+            continue
         obj = img_path.name.split("_")[1][:-1]
-        img_filtered = auto_filter_seal_ins(img, obj)
-        write_png(output_path, img_filtered)
+        jobs.append((img_path, output_path, obj))
+    print(f"[INFO] Filtering {len(jobs)} boxes")
+
+    with ThreadPoolExecutor(io_workers) as readers, \
+         ProcessPoolExecutor(workers) as filterers, \
+         ThreadPoolExecutor(io_workers) as writers:
+        reading, filtering, writing = deque(), deque(), deque()
+
+        def advance(size):
+            # move the oldest boxes to the next stage until each stage fits in `size`
+            while len(reading) > size:
+                output_path, obj, img = reading.popleft()
+                filtering.append(
+                    (output_path, filterers.submit(auto_filter_seal_ins, img.result(), obj, fast))
+                )
+            while len(filtering) > size:
+                output_path, img_filtered = filtering.popleft()
+                writing.append(writers.submit(write_png, output_path, img_filtered.result()))
+            while len(writing) > size:
+                writing.popleft().result()
+
+        for img_path, output_path, obj in jobs:
+            reading.append((output_path, obj, readers.submit(read_image, img_path)))
+            advance(queue_size)
+        advance(0)
 
 
 if __name__ == "__main__":
     boxes_dir = "../data/Seal-Inscription-boxes"
     output_dir = "../data/Seal-Inscription-boxes-filtered"
-    filter_boxes(boxes_dir, output_dir)
+    filter_boxes(boxes_dir, output_dir, incremental=True)
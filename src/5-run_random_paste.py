@@ -1,52 +1,131 @@
 import os
+import json
 import random
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from os.path import join
 from utils.io import read_image, write_png
-from algorithms.random_paste import PaintingObjMulti
+from utils.object_bank import ObjectBank
+from utils.instance_map import save_instance_map
+from algorithms.random_paste import random_paste_from_bank
 
 SEAL_MAX_NUM = 8
 INS_MAX_NUM = 4
 
-def run_random_paste(img_path, obj_dir, img_pasted_path, mask_path, mask_multi_dir, bboxes_path):
-    img = read_image(img_path)
+# the object bank of the current worker process
+_obj_bank = None
+
+
+def painting_seed(seed, name):
+    """Derive the random seed of a painting from the master seed and its name."""
+    digest = hashlib.sha256(f"{seed}_{name}".encode()).digest()
+    return int.from_bytes(digest[:8], "big")
 
-    obj_names = os.listdir(obj_dir)
-    seal_names = [i for i in obj_names if i.split('_')[1] == "seals"]
-    ins_names = [i for i in obj_names if i.split('_')[1] == "inscriptions"]
-    seal_names_sel = random.sample(seal_names, random.randint(1, SEAL_MAX_NUM))
-    ins_names_sel = random.sample(ins_names, random.randint(1, INS_MAX_NUM))
-    obj_names_sel = seal_names_sel + ins_names_sel
-    obj_paths = [os.path.join(obj_dir, i) for i in obj_names_sel]
-    objs = [read_image(i) for i in obj_paths]
-    anns = [i.split('_')[1][:-1] for i in obj_paths]
 
-    painting = PaintingObjMulti(img, objs, anns, by_conflict_ratio=0.2)
-    painting.random_paste()
+def run_random_paste(img_path, obj_bank, img_pasted_path, mask_path, mask_multi_dir, bboxes_path,
+                     exhaustive=False, seed=None, anns_path=None, instance_map_path=None):
+    """
+    Random paste seals/inscriptions sampled from `obj_bank` to one painting and save
+    the results. Return the number of location attempts and dropped objects.
+
+    If `anns_path` is given, the COCO annotations of the objects (RLE segmentation)
+    are saved there as json, for `create_coco_json`. If `instance_map_path` is given,
+    the instance map and its category table are saved there (see `save_instance_map`).
+    `mask_path` and `mask_multi_dir` can be None to skip the merged and the per-object
+    mask images, which can be derived from the instance map.
+    """
+    if seed is not None:
+        random.seed(seed)
+    img = read_image(img_path)
+
+    painting = random_paste_from_bank(img, obj_bank, SEAL_MAX_NUM, INS_MAX_NUM,
+                                      by_conflict_ratio=0.2, exhaustive=exhaustive)
 
     write_png(img_pasted_path, painting.img_pasted)
-    write_png(mask_path, painting.mask)
-    os.makedirs(mask_multi_dir)
-    mask_multi_anns = ["inscription" if i[0] == 0 else "seal" for i in painting.bbox_multi]
-    mask_id = 1
-    for ann, mask in zip(mask_multi_anns, painting.mask_multi):
-        write_png(os.path.join(mask_multi_dir, f"{mask_id}_{ann}.png"), mask)
-        mask_id += 1
+    if mask_path is not None:
+        write_png(mask_path, painting.mask)
+    if mask_multi_dir is not None:
+        os.makedirs(mask_multi_dir)
+        mask_multi_anns = ["inscription" if i[0] == 0 else "seal" for i in painting.bbox_multi]
+        mask_id = 1
+        for ann, mask in zip(mask_multi_anns, painting.mask_multi):
+            write_png(os.path.join(mask_multi_dir, f"{mask_id}_{ann}.png"),
+                      mask.dense(painting.img.shape))
+            mask_id += 1
     with open(bboxes_path, "w") as f:
         f.write("\n".join([" ".join([str(j) for j in i]) for i in painting.bbox_multi]))
-    return None
+    if anns_path is not None:
+        with open(anns_path, "w") as f:
+            json.dump(painting.coco_annotations(), f)
+    if instance_map_path is not None:
+        categories = [i[0] for i in painting.bbox_multi]
+        save_instance_map(instance_map_path, painting.instance_map, categories)
+    return painting.attempt_n, painting.drop_n
+
+
+def _init_worker(obj_bank):
+    global _obj_bank
+    _obj_bank = obj_bank
+
+
+def _run_random_paste_job(img_path, *args):
+    return run_random_paste(img_path, _obj_bank, *args)
+
+
+def run_random_paste_multi(img_dir, obj_dir, img_pasted_dir, mask_dir, mask_multi_root, bboxes_dir,
+                           exhaustive=False, seed=0, workers=None, obj_bank_path=None,
+                           anns_dir=None, instance_map_dir=None, instance_map_format="png"):
+    """
+    Run `run_random_paste` for all the paintings of `img_dir` across `workers`
+    processes (default: the number of CPUs). Each painting is seeded by `seed` and its
+    name, so the results don't depend on the number of workers.
 
+    The objects of `obj_dir` are loaded once into an `ObjectBank`. If `obj_bank_path`
+    is given, the bank is saved there (rebuilt when `obj_dir` changes, see
+    `ObjectBank.from_dir_cached`) and memory-mapped by the workers.
 
-def run_random_paste_multi(img_dir, obj_dir, img_pasted_dir, mask_dir, mask_multi_root, bboxes_dir):
-    _ = [os.makedirs(i) for i in [img_pasted_dir, mask_dir, mask_multi_root, bboxes_dir]]
-    img_names = os.listdir(img_dir)
+    If `anns_dir` is given, the COCO annotations of each painting are saved there
+    (`{name}_anns.json`). If `instance_map_dir` is given, the instance map of each
+    painting is saved there (`{name}_instances.{instance_map_format}`, 'png' or 'npz').
+    `mask_dir` and `mask_multi_root` can be None to skip the merged and the per-object
+    masks.
+    """
+    if obj_bank_path is None:
+        obj_bank = ObjectBank.from_dir(obj_dir)
+    else:
+        obj_bank = ObjectBank.from_dir_cached(obj_dir, obj_bank_path)
+    output_dirs = [img_pasted_dir, mask_dir, mask_multi_root, bboxes_dir, anns_dir,
+                   instance_map_dir]
+    _ = [os.makedirs(i) for i in output_dirs if i is not None]
+    img_names = sorted(os.listdir(img_dir))
     img_paths = [os.path.join(img_dir, i) for i in img_names]
+    jobs = []
     for img_name, img_path in zip(img_names, img_paths):
         name = img_name.split('.')[0]
         img_pasted_path = os.path.join(img_pasted_dir, f"{name}.png")
-        mask_path = os.path.join(mask_dir, f"{name}_mask.png")
-        mask_multi_dir = os.path.join(mask_multi_root, f"{name}-mask-multi")
+        mask_path = None if mask_dir is None else os.path.join(mask_dir, f"{name}_mask.png")
+        mask_multi_dir = None
+        if mask_multi_root is not None:
+            mask_multi_dir = os.path.join(mask_multi_root, f"{name}-mask-multi")
         bboxes_path = os.path.join(bboxes_dir, f"{name}_bboxes.txt")
-        run_random_paste(img_path, obj_dir, img_pasted_path, mask_path, mask_multi_dir, bboxes_path)
+        anns_path = None if anns_dir is None else os.path.join(anns_dir, f"{name}_anns.json")
+        instance_map_path = None
+        if instance_map_dir is not None:
+            instance_map_path = os.path.join(
+                instance_map_dir, f"{name}_instances.{instance_map_format}"
+            )
+        jobs.append((img_path, img_pasted_path, mask_path, mask_multi_dir, bboxes_path,
+                     exhaustive, painting_seed(seed, name), anns_path, instance_map_path))
+    attempt_n, drop_n = 0, 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(obj_bank,)) as executor:
+        futures = [executor.submit(_run_random_paste_job, *job) for job in jobs]
+        for done_n, future in enumerate(as_completed(futures), start=1):
+            attempts, drops = future.result()
+            attempt_n += attempts
+            drop_n += drops
+            print(f"[INFO] Pasted {done_n}/{len(jobs)} images")
+    print(f"[INFO] {len(img_names)} images: {attempt_n} location attempts, {drop_n} objects dropped")
 
 
 if __name__ == "__main__":
@@ -57,8 +136,11 @@ if __name__ == "__main__":
         os.makedirs(join(output_root, i))
         img_dir = join(data_root, "Chinese-Painting-s800-nosi", i)
         obj_dir = join(data_root, "Seal-Inscription-boxes-filtered-manual")
+        obj_bank_path = join(data_root, "Seal-Inscription-boxes-filtered-manual.bank")
         img_pasted_dir = join(data_root, output_root, i, "imgs_pasted")
-        mask_dir = join(data_root, output_root, i, "masks")
-        mask_multi_root = join(data_root, output_root, i, "masks_multi")
         bboxes_dir = join(data_root, output_root, i, "bboxes")
-        run_random_paste_multi(img_dir, obj_dir, img_pasted_dir, mask_dir, mask_multi_root, bboxes_dir)
+        anns_dir = join(data_root, output_root, i, "anns")
+        instance_map_dir = join(data_root, output_root, i, "instances")
+        run_random_paste_multi(img_dir, obj_dir, img_pasted_dir, None, None, bboxes_dir,
+                               obj_bank_path=obj_bank_path, anns_dir=anns_dir,
+                               instance_map_dir=instance_map_dir)
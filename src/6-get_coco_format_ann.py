@@ -1,9 +1,11 @@
 import json
 import os
+import shutil
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from os.path import join
-from PIL import Image
-from utils.io import read_image
+from utils.io import read_image, read_image_size
 
 
 def binary_mask_to_rle(binary_mask):
@@ -28,69 +30,98 @@ def bboxes_txt_to_dic(path):
     return dic
 
 
-def create_coco_json(image_dir, mask_multi_root, bboxes_dir, output_json_path):
+def image_annotations(img_filename, image_dir, mask_multi_root, bboxes_dir, anns_dir=None):
+    """
+    Return the image info and the annotations (both without ids) of one pasted image.
+    If `anns_dir` is given, the annotations are read from the `{name}_anns.json` saved
+    by the random paste (RLE segmentation already encoded), else they're encoded from
+    the per-object masks and bboxes.
+    """
+    # Get image dimensions (header only)
+    width, height = read_image_size(join(image_dir, img_filename))
+    image_info = {"file_name": img_filename, "width": width, "height": height}
+    img_filename_id = img_filename.split('.')[0]
+    if anns_dir is not None:
+        with open(join(anns_dir, f"{img_filename_id}_anns.json")) as f:
+            return image_info, json.load(f)
+    # Load corresponding masks, ordered by their id (`{mask_id}_{ann}.png`)
+    mask_multi_dir = join(mask_multi_root, f"{img_filename_id}-mask-multi")
+    mask_names = sorted(os.listdir(mask_multi_dir), key=lambda i: int(i.split('_')[0]))
+    masks = [read_image(join(mask_multi_dir, i)) for i in mask_names]
+    # Load corresponding bboxes
+    bboxes_path = join(bboxes_dir, f"{img_filename_id}_bboxes.txt")
+    bboxes_dic = bboxes_txt_to_dic(bboxes_path)
+    # Iterate over bboxes and masks to create annotations
+    annotations = []
+    for ann, bbox, mask in zip(bboxes_dic['ann'], bboxes_dic['bbox'], masks):
+        x_min, y_min, x_max, y_max = bbox
+        x, y, w, h = x_min, y_min, x_max - x_min, y_max - y_min
+        binary_mask = (mask[:, :, 0] > 0).astype(np.uint8)
+        area = float(binary_mask.sum())
+        rle = binary_mask_to_rle(binary_mask)
+        annotation_info = {
+            "category_id": ann,
+            "bbox": [x, y, w, h],
+            "area": area,
+            "segmentation": rle,
+            "iscrowd": 0,
+        }
+        annotations.append(annotation_info)
+    return image_info, annotations
+
+
+def create_coco_json(image_dir, mask_multi_root, bboxes_dir, output_json_path, anns_dir=None,
+                     workers=None, chunksize=16):
+    """
+    Create the COCO json of the pasted images (see `image_annotations`), processed by
+    `workers` processes (default: the number of CPUs).
+
+    `images` are streamed to the output file and `annotations` to a temporary file
+    appended after them, so the dataset is never held in memory. Images are ordered by
+    filename, so the output is byte-identical whatever the number of workers (and to
+    a `json.dump` of the whole dict).
+    """
     categories = [{"id": 0, "name": "Inscription"}, {"id": 1, "name": "Seal"}]
-    coco_dict = {
-        "info": {
-            "description": "Dataset",
-            "url": "",
-            "version": "1.0",
-            "year": 2024,
-            "contributor": "",
-            "date_created": "2024-05-22",
-        },
-        "licenses": [],
-        "images": [],
-        "annotations": [],
-        "categories": categories,
+    info = {
+        "description": "Dataset",
+        "url": "",
+        "version": "1.0",
+        "year": 2024,
+        "contributor": "",
+        "date_created": "2024-05-22",
     }
 
     image_id = 1
     annotation_id = 1
 
-    for img_filename in os.listdir(image_dir):
-        # Load image and get its dimensions
-        img_path = join(image_dir, img_filename)
-        img = Image.open(img_path)
-        width, height = img.size
-        # Add image info
-        image_info = {
-            "id": image_id,
-            "file_name": img_filename,
-            "width": width,
-            "height": height,
-        }
-        coco_dict["images"].append(image_info)
-        # Load corresponding masks
-        img_filename_id = img_filename.split('.')[0]
-        mask_multi_dir = join(mask_multi_root, f"{img_filename_id}-mask-multi")
-        mask_paths = [join(mask_multi_dir, i) for i in os.listdir(mask_multi_dir)]
-        masks = [read_image(i) for i in mask_paths]
-        # Load corresponding bboxes
-        bboxes_path = join(bboxes_dir, f"{img_filename_id}_bboxes.txt")
-        bboxes_dic = bboxes_txt_to_dic(bboxes_path)
-        # Iterate over bboxes and masks to create annotations
-        for ann, bbox, mask in zip(bboxes_dic['ann'], bboxes_dic['bbox'], masks):
-            x_min, y_min, x_max, y_max = bbox
-            x, y, w, h = x_min, y_min, x_max - x_min, y_max - y_min
-            binary_mask = (mask[:, :, 0] > 0).astype(np.uint8)
-            area = float(binary_mask.sum())
-            rle = binary_mask_to_rle(binary_mask)
-            annotation_info = {
-                "id": annotation_id,
-                "image_id": image_id,
-                "category_id": ann,
-                "bbox": [x, y, w, h],
-                "area": area,
-                "segmentation": rle,
-                "iscrowd": 0,
-            }
-            coco_dict["annotations"].append(annotation_info)
-            annotation_id += 1
-        image_id += 1
-    # Save to JSON file
-    with open(output_json_path, "w") as json_file:
-        json.dump(coco_dict, json_file)
+    img_filenames = sorted(os.listdir(image_dir))
+    annotations_tmp_path = f"{output_json_path}.annotations.tmp"
+    with open(output_json_path, "w") as json_file, \
+         open(annotations_tmp_path, "w+") as annotations_file, \
+         ProcessPoolExecutor(workers) as executor:
+        json_file.write(f'{{"info": {json.dumps(info)}, "licenses": [], "images": [')
+        results = executor.map(
+            partial(image_annotations, image_dir=image_dir, mask_multi_root=mask_multi_root,
+                    bboxes_dir=bboxes_dir, anns_dir=anns_dir),
+            img_filenames,
+            chunksize=chunksize,
+        )
+        for image_info, annotations in results:
+            # Add image info
+            sep = "" if image_id == 1 else ", "
+            json_file.write(sep + json.dumps({"id": image_id, **image_info}))
+            for annotation_info in annotations:
+                sep = "" if annotation_id == 1 else ", "
+                annotations_file.write(sep + json.dumps(
+                    {"id": annotation_id, "image_id": image_id, **annotation_info}
+                ))
+                annotation_id += 1
+            image_id += 1
+        json_file.write('], "annotations": [')
+        annotations_file.seek(0)
+        shutil.copyfileobj(annotations_file, json_file)
+        json_file.write(f'], "categories": {json.dumps(categories)}}}')
+    os.remove(annotations_tmp_path)
 
 
 if __name__ == "__main__":
@@ -99,5 +130,6 @@ if __name__ == "__main__":
         image_dir = join(data_root, "imgs_pasted")
         mask_multi_root = join(data_root, "masks_multi")
         bboxes_dir = join(data_root, "bboxes")
+        anns_dir = join(data_root, "anns")
         output_json_path = join(data_root, f"json_annotation_{i}.json")
-        create_coco_json(image_dir, mask_multi_root, bboxes_dir, output_json_path)
+        create_coco_json(image_dir, mask_multi_root, bboxes_dir, output_json_path, anns_dir)
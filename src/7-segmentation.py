@@ -10,11 +10,18 @@ from detectron2.config import get_cfg
 from detectron2.utils.logger import setup_logger
 from detectron2.utils.visualizer import Visualizer, ColorMode
 from detectron2.data import MetadataCatalog, DatasetCatalog, build_detection_test_loader
+from detectron2.data import build_detection_train_loader
 from detectron2.data.datasets import register_coco_instances
 from detectron2.evaluation import COCOEvaluator, inference_on_dataset
+from utils.object_bank import ObjectBank
+from utils.paste_mapper import PasteDatasetMapper, register_paste_dataset
 
 setup_logger()
 
+# If True, train on paintings random pasted on the fly (see `PasteDatasetMapper`)
+# instead of the pre-rendered `Chinese-Painting-s800-pasted/train`
+ONLINE_PASTE = False
+
 
 # Prepare the dataset
 # ===================
@@ -31,20 +38,34 @@ register_coco_instances(
     join(data_root, "val", "json_annotation_val.json"),
     join(data_root, "val", "imgs_pasted"),
 )
+if ONLINE_PASTE:
+    register_paste_dataset("painting_train_online", "../data/Chinese-Painting-s800-nosi/train")
+    # shared with `5-run_random_paste.py`, rebuilt if the objects changed
+    obj_bank = ObjectBank.from_dir_cached(
+        "../data/Seal-Inscription-boxes-filtered-manual",
+        "../data/Seal-Inscription-boxes-filtered-manual.bank",
+    )
 
 dataset_dicts = DatasetCatalog.get("painting_train")
 metadata = MetadataCatalog.get("painting_train")
 
 
+class PasteTrainer(DefaultTrainer):
+    @classmethod
+    def build_train_loader(cls, cfg):
+        return build_detection_train_loader(cfg, mapper=PasteDatasetMapper(cfg, obj_bank))
+
+
 # Train
 # =====
 cfg = get_cfg()
 cfg.merge_from_file(
     model_zoo.get_config_file("COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_1x.yaml")
 )
-cfg.DATASETS.TRAIN = ("painting_train",)
+cfg.DATASETS.TRAIN = ("painting_train_online",) if ONLINE_PASTE else ("painting_train",)
 cfg.DATASETS.TEST = ()
-cfg.DATALOADER.NUM_WORKERS = 1
+# pasting takes ~0.2 s per 800x800 painting on a CPU core, 8 workers paste ~40 images/s
+cfg.DATALOADER.NUM_WORKERS = 8 if ONLINE_PASTE else 1
 cfg.MODEL.WEIGHTS = model_zoo.get_checkpoint_url(
     "COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_1x.yaml"
 )  # Let training initialize from model zoo
@@ -60,7 +81,7 @@ cfg.MODEL.ROI_HEADS.BATCH_SIZE_PER_IMAGE = 64
 cfg.MODEL.ROI_HEADS.NUM_CLASSES = 2
 
 os.makedirs(cfg.OUTPUT_DIR, exist_ok=True)
-trainer = DefaultTrainer(cfg)
+trainer = PasteTrainer(cfg) if ONLINE_PASTE else DefaultTrainer(cfg)
 trainer.resume_or_load(resume=False)
 trainer.train()
 
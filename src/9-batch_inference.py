@@ -0,0 +1,137 @@
+# Predict the seals/inscriptions of a directory of paintings (e.g. the crawled archive)
+# with the model trained by `7-segmentation.py`. Predictions are appended to a JSON
+# lines file, one line per image:
+#
+#   {"file_name": ..., "height": ..., "width": ..., "instances": [{"category_id": ...,
+#    "score": ..., "bbox": [x, y, w, h], "segmentation": {"size": ..., "counts": ...}}]}
+#
+# Re-runs skip the images already in the file, so an interrupted run can be resumed.
+# Images which can't be decoded (e.g. truncated downloads) are recorded with an
+# "error" instead of "instances", and skipped by re-runs too.
+# With `--tile`, full resolution scans are predicted by overlapping windows (see
+# `TiledPredictor`), read window by window from uncompressed TIFFs.
+
+import os
+import json
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import torch
+from utils.inference import BatchPredictor, encode_instances, export_model, get_inference_cfg
+from utils.io import read_image_lazy
+from utils.predictions import read_predicted
+from utils.tiled_inference import TiledPredictor
+
+
+def batch_inference(img_dir, weights, output_path, batch_size=4, threads=None, io_workers=4,
+                    prefetch=16, score_thresh=0.7, export_format=None, tile=None,
+                    tile_overlap=200):
+    """
+    Predict the images of `img_dir` not yet in `output_path`, in batches of
+    `batch_size` on the CPU with `threads` threads (default: torch's default). Images
+    are decoded by `io_workers` threads, at most `prefetch` ahead of the model.
+
+    If `tile` is given, each image is predicted at full resolution by windows of `tile`
+    pixels overlapping by `tile_overlap`, in batches of `batch_size` windows.
+    Uncompressed TIFFs are decoded window by window (see `read_image_lazy`), other
+    formats (e.g. JPEG, which can't be decoded by region) are decoded fully (as RGB).
+    As a decoded scan can take hundreds of MB, at most 2 are held at once: the one
+    predicted and the next (`prefetch` is capped to 2).
+
+    If `export_format` is given ('torchscript' or 'onnx'), the model is also exported
+    next to `weights`, traced on the first image.
+    """
+    if threads is not None:
+        torch.set_num_threads(threads)
+    predicted = read_predicted(output_path)
+    img_names = [i for i in sorted(os.listdir(img_dir)) if i not in predicted]
+    print(f"[INFO] Predicting {len(img_names)} images ({len(predicted)} already predicted)")
+    predictor = BatchPredictor(get_inference_cfg(weights, score_thresh))
+    if export_format is not None and img_names != []:
+        ext = ".ts" if export_format == "torchscript" else ".onnx"
+        export_path = os.path.splitext(weights)[0] + ext
+        # traced on the first image which can be decoded
+        for img_name in img_names:
+            try:
+                sample_input = predictor.load(os.path.join(img_dir, img_name))
+                break
+            except Exception as e:
+                print(f"[INFO] Failed to decode {img_name}: {e!r}")
+        export_model(predictor, sample_input, export_format, export_path)
+        print(f"[INFO] Exported the model to {export_path}")
+    if tile is None:
+        load = predictor.load
+    else:
+        load = read_image_lazy
+        tiled_predictor = TiledPredictor(predictor, tile, tile_overlap, batch_size)
+        # one image at a time, its windows are batched
+        batch_size = 1
+        prefetch = min(prefetch, 2)
+
+    start, done_n = time.perf_counter(), 0
+    with ThreadPoolExecutor(io_workers) as readers, open(output_path, "a") as f:
+        pending = deque()
+        names = iter(img_names)
+        while True:
+            # keep the readers `prefetch` images ahead
+            for img_name in names:
+                future = readers.submit(load, os.path.join(img_dir, img_name))
+                pending.append((img_name, future))
+                if len(pending) >= prefetch:
+                    break
+            if not pending:
+                break
+            batch = [pending.popleft() for _ in range(min(batch_size, len(pending)))]
+            batch_names, inputs = [], []
+            for img_name, future in batch:
+                try:
+                    inputs.append(future.result())
+                    batch_names.append(img_name)
+                except Exception as e:
+                    print(f"[INFO] Failed to decode {img_name}: {e!r}")
+                    f.write(json.dumps({"file_name": img_name, "error": repr(e)}) + "\n")
+                    done_n += 1
+            # drop the futures, so the decoded images are freed with `inputs`
+            del batch, future
+            if inputs == []:
+                records = []
+            elif tile is None:
+                records = [
+                    (input_["height"], input_["width"], encode_instances(instances))
+                    for input_, instances in zip(inputs, predictor(inputs))
+                ]
+            else:
+                records = [(img.shape[0], img.shape[1], tiled_predictor(img)) for img in inputs]
+            del inputs
+            for img_name, (height, width, instances) in zip(batch_names, records):
+                record = {
+                    "file_name": img_name,
+                    "height": height,
+                    "width": width,
+                    "instances": instances,
+                }
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            done_n += len(batch_names)
+            speed = done_n / (time.perf_counter() - start)
+            print(f"[INFO] Predicted {done_n}/{len(img_names)} images ({speed:.2f} images/s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batch inference of seals/inscriptions.")
+    parser.add_argument("img_dir")
+    parser.add_argument("--weights", default="./output/model_final.pth")
+    parser.add_argument("--output", default="./output/predictions.jsonl")
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=None, help="torch CPU threads")
+    parser.add_argument("--io-workers", type=int, default=4)
+    parser.add_argument("--prefetch", type=int, default=16)
+    parser.add_argument("--score-thresh", type=float, default=0.7)
+    parser.add_argument("--export", choices=["torchscript", "onnx"], default=None)
+    parser.add_argument("--tile", type=int, default=None, help="window size, e.g. 800")
+    parser.add_argument("--tile-overlap", type=int, default=200)
+    args = parser.parse_args()
+    batch_inference(args.img_dir, args.weights, args.output, args.batch_size, args.threads,
+                    args.io_workers, args.prefetch, args.score_thresh, args.export, args.tile,
+                    args.tile_overlap)
@@ -0,0 +1,81 @@
+import numpy as np
+from numpy.typing import NDArray
+
+
+def _bits_to_int(bits: NDArray[bool]) -> int:
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+
+def dhash(gray: NDArray[np.uint8]) -> int:
+    """
+    Difference hash of a grayscale image already resized to `(n, n + 1)`: each bit
+    tells whether a pixel is brighter than its left neighbour.
+    """
+    gray = gray.astype(np.int16)
+    return _bits_to_int(gray[:, 1:] > gray[:, :-1])
+
+
+def _dct_matrix(n: int) -> NDArray[np.float64]:
+    """Orthonormal DCT-II matrix."""
+    k, i = np.meshgrid(np.arange(n), np.arange(n), indexing="ij")
+    dct = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    dct[0] /= np.sqrt(2)
+    return dct
+
+
+def phash(gray: NDArray[np.uint8], hash_size: int = 8) -> int:
+    """
+    Perceptual hash of a grayscale image already resized to `(n, n)` (usually 32x32):
+    each bit tells whether a low frequency DCT coefficient is above their median.
+    """
+    dct_m = _dct_matrix(gray.shape[0])
+    dct = dct_m @ gray.astype(np.float64) @ dct_m.T
+    low = dct[:hash_size, :hash_size]
+    return _bits_to_int(low > np.median(low))
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """
+    BK-tree of hashes under the Hamming distance, to find the hashes within a
+    distance of a query without comparing against all of them.
+    """
+
+    def __init__(self) -> None:
+        # node: [hash, items, {distance: child node}]
+        self.root = None
+
+    def add(self, hash_: int, item) -> None:
+        if self.root is None:
+            self.root = [hash_, [item], {}]
+            return None
+        node = self.root
+        while True:
+            d = hamming(hash_, node[0])
+            if d == 0:
+                node[1].append(item)
+                return None
+            if d not in node[2]:
+                node[2][d] = [hash_, [item], {}]
+                return None
+            node = node[2][d]
+
+    def query(self, hash_: int, max_distance: int) -> list:
+        """Items whose hash is within `max_distance` of `hash_`."""
+        if self.root is None:
+            return []
+        items, nodes = [], [self.root]
+        while nodes:
+            node = nodes.pop()
+            d = hamming(hash_, node[0])
+            if d <= max_distance:
+                items.extend(node[1])
+            # by the triangle inequality, only children in this range could match
+            nodes.extend(
+                child for k, child in node[2].items()
+                if d - max_distance <= k <= d + max_distance
+            )
+        return items
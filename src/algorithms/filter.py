@@ -11,6 +11,24 @@ B_THRESHOLD = -5
 S_THRESHOLD = 0.17
 V_THRESHOLD = (0.18, 0.86)
 
+# sRGB (D65) to XYZ normalized by the D65 reference white, as `color.rgb2lab`
+_XYZ_FROM_RGB = (
+    np.array(
+        [
+            [0.412453, 0.357580, 0.180423],
+            [0.212671, 0.715160, 0.072169],
+            [0.019334, 0.119193, 0.950227],
+        ]
+    )
+    / np.array([[0.95047], [1.0], [1.08883]])
+).astype(np.float32)
+# uint8 sRGB to linear RGB lookup table
+_LINEAR_FROM_SRGB = np.where(
+    np.arange(256) / 255 > 0.04045,
+    ((np.arange(256) / 255 + 0.055) / 1.055) ** 2.4,
+    np.arange(256) / 255 / 12.92,
+).astype(np.float32)
+
 
 def filter_red_by_lab(
     rgb_img: NDArray[np.uint8], a_threshold: int, b_threshold: int
@@ -44,12 +62,83 @@ def filter_black_by_hsv(
     return (rgb_filtered * 255).astype(np.uint8)
 
 
-def auto_filter_seal_ins(img: NDArray[np.uint8], obj: str) -> NDArray[np.uint8]:
-    """Auto filter based on the object's kind."""
+def red_mask_by_lab(
+    rgb_img: NDArray[np.uint8], a_threshold: int, b_threshold: int
+) -> NDArray[bool]:
+    """
+    The mask of the red pixels kept by `filter_red_by_lab`, computing only the a and b
+    channels of lab color space in float32.
+    """
+    xyz = _LINEAR_FROM_SRGB[rgb_img] @ _XYZ_FROM_RGB.T
+    f = np.where(xyz > 0.008856, np.cbrt(xyz), 7.787 * xyz + np.float32(16 / 116))
+    a_cond = 500 * (f[..., 0] - f[..., 1]) > a_threshold
+    b_cond = 200 * (f[..., 1] - f[..., 2]) < b_threshold
+    return a_cond | b_cond
+
+
+def black_mask_by_hsv(
+    rgb_img: NDArray[np.uint8], s_threshold: int, v_threshold: Tuple[float, float]
+) -> NDArray[bool]:
+    """
+    The mask of the black pixels kept by `filter_black_by_hsv`. As s and v only depend
+    on the max and min of rgb, the mask is looked up from a (max, min) table.
+    """
+    rgb_max = np.arange(256)[:, np.newaxis] / 255
+    rgb_min = np.arange(256)[np.newaxis, :] / 255
+    delta = rgb_max - rgb_min
+    s = np.divide(delta, rgb_max, out=np.zeros_like(delta), where=delta > 0)
+    s_cond = s < s_threshold
+    v_cond = (rgb_max > v_threshold[0]) & (rgb_max < v_threshold[1])
+    return (s_cond & v_cond)[rgb_img.max(axis=-1), rgb_img.min(axis=-1)]
+
+
+def _auto_mask_seal_ins(img: NDArray[np.uint8], obj: str) -> NDArray[bool]:
+    """The mask of the pixels kept by `auto_filter_seal_ins`."""
     if obj == "seal":
+        return red_mask_by_lab(img, A_THRESHOLD, B_THRESHOLD)
+    elif obj == "inscription":
+        return black_mask_by_hsv(img, S_THRESHOLD, V_THRESHOLD)
+    else:
+        raise ValueError("Argument 'obj' must be 'seal' or 'inscription'.")
+
+
+def auto_filter_seal_ins(
+    img: NDArray[np.uint8], obj: str, fast: bool = False
+) -> NDArray[np.uint8]:
+    """
+    Auto filter based on the object's kind.
+
+    If `fast` is True, only the mask of the kept pixels is computed, and the other
+    pixels of a copy of `img` are set to white. Compared with the color space round
+    trip, kept pixels keep their original values instead of being off by up to 1, and
+    (for seals only, as lab is computed in float32) pixels within float32 precision of
+    a threshold may be classified differently (5 of all the 2^24 colors).
+    """
+    if fast:
+        img_filtered = img.copy()
+        img_filtered[~_auto_mask_seal_ins(img, obj)] = 255
+    elif obj == "seal":
         img_filtered = filter_red_by_lab(img, A_THRESHOLD, B_THRESHOLD)
     elif obj == "inscription":
         img_filtered = filter_black_by_hsv(img, S_THRESHOLD, V_THRESHOLD)
     else:
         raise ValueError("Argument 'obj' must be 'seal' or 'inscription'.")
     return img_filtered
+
+
+def auto_filter_seal_ins_batch(
+    imgs: list[NDArray[np.uint8]], objs: list[str]
+) -> list[NDArray[np.uint8]]:
+    """
+    Fast `auto_filter_seal_ins` for a batch of boxes of any sizes: the pixels of all
+    the boxes of a kind are filtered in one vectorized pass.
+    """
+    imgs_filtered = [i.copy() for i in imgs]
+    for obj in set(objs):
+        idxs = [i for i, v in enumerate(objs) if v == obj]
+        pixels = np.concatenate([imgs[i].reshape(-1, 3) for i in idxs])
+        keep = _auto_mask_seal_ins(pixels, obj)
+        splits = np.cumsum([imgs[i].shape[0] * imgs[i].shape[1] for i in idxs])[:-1]
+        for i, keep_i in zip(idxs, np.split(keep, splits)):
+            imgs_filtered[i][~keep_i.reshape(imgs[i].shape[:2])] = 255
+    return imgs_filtered
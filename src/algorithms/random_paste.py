@@ -1,25 +1,145 @@
 # Date: 2024/4/17
 import random
 import numpy as np
-from functools import lru_cache
+from functools import cached_property
+from typing import NamedTuple
 from numpy.typing import NDArray
+from pycocotools import mask as mask_utils
 from skimage import color, filters, morphology
 
 
+def _smooth_gray(img: NDArray[np.uint8]) -> NDArray[np.float64]:
+    return filters.gaussian(color.rgb2gray(img), sigma=1)
+
+
 def _segment_fore_back(img: NDArray[np.uint8]) -> NDArray[bool]:
     """
     Segment a colorful image to distinguish foreground (represented by False)
     and background (represented by True).
     """
-    gray_img = color.rgb2gray(img)
-    smooth_img = filters.gaussian(gray_img, sigma=1)
-    threshold_value = filters.threshold_otsu(smooth_img)
-    bin_img = smooth_img > threshold_value
-    # if True is more common than False, invert color
-    bin_img = bin_img if bin_img.sum() > bin_img.size / 2 else ~bin_img
-    closed_img = morphology.closing(bin_img, morphology.square(3))
-    segmented_img = np.stack([closed_img for _ in range(3)], axis=-1)
-    return segmented_img
+    return IncrementalSegmentation(img).segmented
+
+
+class IncrementalSegmentation:
+    """
+    Foreground (False) / background (True) segmentation of a painting, which is updated
+    only around the boxes where objects get pasted instead of segmenting the whole
+    image again.
+
+    Note: The Otsu threshold and whether to invert are decided once, on the image
+    before any paste.
+    """
+
+    # pixels whose segmentation may change around a changed pixel: the gaussian kernel
+    # radius (4 * sigma) plus the reach of the closing (dilation then erosion)
+    MARGIN = 4 + 1 + 1
+    # pixels needed around the margin to segment it exactly: the closing (dilation then
+    # erosion) and the gaussian kernel radiuses
+    CONTEXT = 1 + 1 + 4
+
+    def __init__(self, img: NDArray[np.uint8]) -> None:
+        smooth_img = _smooth_gray(img)
+        self.threshold = filters.threshold_otsu(smooth_img)
+        bin_img = smooth_img > self.threshold
+        # if True is more common than False, invert color
+        self.invert = not bin_img.sum() > bin_img.size / 2
+        self.segmented = self._close(bin_img)
+
+    def _close(self, bin_img: NDArray[bool]) -> NDArray[bool]:
+        bin_img = ~bin_img if self.invert else bin_img
+        return morphology.closing(bin_img, morphology.square(3))
+
+    def update(self, img: NDArray[np.uint8], y: int, x: int, h: int, w: int) -> None:
+        """Update the segmentation after the box `(y, x, h, w)` of `img` changed."""
+        img_h, img_w = self.segmented.shape
+        # the box plus margin to update, and the window plus context to segment
+        y0, y1 = max(y - self.MARGIN, 0), min(y + h + self.MARGIN, img_h)
+        x0, x1 = max(x - self.MARGIN, 0), min(x + w + self.MARGIN, img_w)
+        wy0, wy1 = max(y0 - self.CONTEXT, 0), min(y1 + self.CONTEXT, img_h)
+        wx0, wx1 = max(x0 - self.CONTEXT, 0), min(x1 + self.CONTEXT, img_w)
+        bin_img = _smooth_gray(img[wy0:wy1, wx0:wx1]) > self.threshold
+        closed_img = self._close(bin_img)
+        self.segmented[y0:y1, x0:x1] = closed_img[y0 - wy0:y1 - wy0, x0 - wx0:x1 - wx0]
+        return None
+
+
+def non_white_mask(img: NDArray[np.uint8]) -> NDArray[bool]:
+    """Mask of the non-white pixels of an object image."""
+    return ~np.all(img == 255, axis=-1)
+
+
+def _integral_image(img: NDArray[bool]) -> NDArray[np.int64]:
+    """
+    Summed-area table of a 2D image, padded with a leading row and column of zeros so
+    that `sat[y, x]` is the sum of `img[:y, :x]`.
+    """
+    sat = np.zeros((img.shape[0] + 1, img.shape[1] + 1), dtype=np.int64)
+    np.cumsum(np.cumsum(img, axis=0), axis=1, out=sat[1:, 1:])
+    return sat
+
+
+def _box_sum(sat: NDArray[np.int64], y: int, x: int, h: int, w: int) -> int:
+    """Sum of the box `(y, x, h, w)` of an image in O(1), given its summed-area table."""
+    return int(sat[y + h, x + w] - sat[y, x + w] - sat[y + h, x] + sat[y, x])
+
+
+def _box_sum_map(sat: NDArray[np.int64], h: int, w: int) -> NDArray[np.int64]:
+    """
+    Sums of all the `(h, w)` boxes of an image, indexed by their top-left location,
+    given its summed-area table.
+    """
+    return sat[h:, w:] - sat[:-h, w:] - sat[h:, :-w] + sat[:-h, :-w]
+
+
+def local_rle(patch: NDArray[bool], y: int, x: int, height: int, width: int) -> dict:
+    """
+    COCO compressed RLE (with `counts` as str) of an image of `(height, width)` whose
+    mask is `patch` at `(y, x)`, computed from the patch without the full-size mask.
+    """
+    h, w = patch.shape
+    # the columns of the patch, each followed by a placeholder for the `height - h`
+    # zeros up to the patch in the next column (in column-major order), between the
+    # zeros before and after the patch
+    cols = np.zeros((w, h + 1), dtype=bool)
+    cols[:, :h] = patch.T
+    weights = np.ones((w, h + 1), dtype=np.int64)
+    weights[:, h] = height - h
+    weights[-1, h] = height - h - y
+    values = np.concatenate([[False], cols.ravel(), [False]])
+    weights = np.concatenate([[x * height + y], weights.ravel(), [(width - x - w) * height]])
+    # drop the empty placeholders, but the first (the counts start with zeros)
+    keep = weights > 0
+    keep[0] = True
+    values, weights = values[keep], weights[keep]
+    # merge consecutive equal values into runs, which start with zeros
+    run_starts = np.concatenate([[0], np.flatnonzero(values[1:] != values[:-1]) + 1])
+    counts = np.add.reduceat(weights, run_starts).tolist()
+    rle = mask_utils.frPyObjects({"counts": counts, "size": [height, width]}, height, width)
+    rle["counts"] = rle["counts"].decode("ascii")
+    return rle
+
+
+class LocalMask(NamedTuple):
+    """Mask of an object as its bbox `(y, x, h, w)` in the image and a local patch."""
+
+    loc: tuple[int, int, int, int]
+    patch: NDArray[bool]
+
+    @property
+    def slice(self) -> tuple[slice, slice]:
+        y, x, h, w = self.loc
+        return slice(y, y + h), slice(x, x + w)
+
+    def dense(self, shape: tuple) -> NDArray[np.uint8]:
+        """The full mask (255) of an image of `shape`."""
+        mask = np.zeros(shape, dtype=np.uint8)
+        mask[self.slice][self.patch] = 255
+        return mask
+
+    def rle(self, height: int, width: int) -> dict:
+        """The mask in an image of `(height, width)` as COCO compressed RLE (`local_rle`)."""
+        y, x, _, _ = self.loc
+        return local_rle(self.patch, y, x, height, width)
 
 
 class PaintingObj:
@@ -28,27 +148,49 @@ class PaintingObj:
     """
 
     def __init__(
-        self, img: NDArray[np.uint8], obj: NDArray[np.uint8], ann: int, by_conflict: bool
+        self,
+        img: NDArray[np.uint8],
+        obj: NDArray[np.uint8],
+        ann: int,
+        by_conflict: bool,
+        exhaustive: bool = False,
+        obj_mask: NDArray[bool] | None = None,
+        segmented_image: NDArray[bool] | None = None,
     ) -> None:
         """
         `ann` could be 0 (ins) or 1 (seal). If `by_conflict` is True, the object bbox
         would be conflict with the image's foreground, else would not be conflict with
-        foreground.
+        foreground. If `exhaustive` is True, the location is sampled uniformly from all
+        the valid locations instead of by random attempts. `obj_mask` is the object's
+        precomputed non-white mask, computed from `obj` if not given.
+        `segmented_image` is the image's precomputed segmentation (see
+        `IncrementalSegmentation`), computed from `img` if not given.
         """
         self.img = img
         self.obj = obj
         self.ann = ann
         self.by_conflict = by_conflict
+        self.exhaustive = exhaustive
+        self._obj_mask = obj_mask
+        self._segmented_image = segmented_image
+        self.attempt_n = 0
 
-    @property
-    @lru_cache
+    @cached_property
     def segmented_image(self) -> NDArray[bool]:
+        """Background (True) map of the image."""
+        if self._segmented_image is not None:
+            return self._segmented_image
         return _segment_fore_back(self.img)
 
-    def _random_location_dic(self) -> dict[tuple[int], NDArray[np.uint8]]:
+    @cached_property
+    def fore_integral(self) -> NDArray[np.int64]:
+        """Summed-area table of the image's foreground."""
+        return _integral_image(~self.segmented_image)
+
+    def _random_location(self) -> tuple[int, int, int, int]:
         """
-        Randomly select a location for the object within the image. The condition is
-        that the entire object must fit within the image (no cropping).
+        Randomly select a location `(y, x, h, w)` for the object within the image. The
+        condition is that the entire object must fit within the image (no cropping).
         """
         img_h, img_w, _ = self.img.shape
         # calculate object width & height
@@ -57,83 +199,115 @@ class PaintingObj:
         # randomly generate object center index based image shape
         obj_center_x = random.randint(0 + obj_w_half + 1, img_w - obj_w_half - 2)
         obj_center_y = random.randint(0 + obj_h_half + 1, img_h - obj_h_half - 2)
-        # get object's location of the image
-        obj_idx_x_start = obj_center_x - obj_w_half
-        obj_idx_x = list(range(obj_idx_x_start, obj_idx_x_start + obj_w))
-        obj_idx_y_start = obj_center_y - obj_h_half
-        obj_idx_y = list(range(obj_idx_y_start, obj_idx_y_start + obj_h))
-        # get the object location of image and its idx:val dict
-        obj_loc = [(j, i) for i in obj_idx_x for j in obj_idx_y]
-        obj_val_flat = self.obj.transpose(1, 0, 2).reshape(-1, 3)
-        return {k: v for k, v in zip(obj_loc, obj_val_flat)}
+        # get object's top-left location of the image
+        return obj_center_y - obj_h_half, obj_center_x - obj_w_half, obj_h, obj_w
 
-    @property
-    @lru_cache
-    def obj_loc_dic(self) -> dict[tuple[int], NDArray[np.uint8]]:
+    @cached_property
+    def valid_loc_map(self) -> NDArray[bool]:
+        """
+        Map of the valid top-left locations of the object, within the same range as
+        `_random_location`.
+        """
+        img_h, img_w, _ = self.img.shape
+        obj_h, obj_w, _ = self.obj.shape
+        is_conflict = _box_sum_map(self.fore_integral, obj_h, obj_w) != 0
+        valid = is_conflict if self.by_conflict else ~is_conflict
+        # the top-left range of `_random_location` is [1, img - obj // 2 * 2 - 2]
+        y_end = max(img_h - obj_h // 2 * 2 - 2, 0) + 1
+        x_end = max(img_w - obj_w // 2 * 2 - 2, 0) + 1
+        valid_loc_map = np.zeros(valid.shape, dtype=bool)
+        valid_loc_map[1:y_end, 1:x_end] = valid[1:y_end, 1:x_end]
+        return valid_loc_map
+
+    def _exhaustive_location(self) -> tuple[int, int, int, int] | None:
+        """
+        Uniformly select a location `(y, x, h, w)` from all the valid locations. Return
+        None if there is no valid location.
+        """
+        self.attempt_n = 1
+        valid_locs = np.flatnonzero(self.valid_loc_map)
+        if valid_locs.size == 0:
+            return None
+        valid_loc = valid_locs[random.randrange(valid_locs.size)]
+        y, x = np.unravel_index(valid_loc, self.valid_loc_map.shape)
+        obj_h, obj_w, _ = self.obj.shape
+        return int(y), int(x), obj_h, obj_w
+
+    @cached_property
+    def obj_loc(self) -> tuple[int, int, int, int] | None:
         """
-        The object bbox location dic of the image.
+        The object bbox location `(y, x, h, w)` of the image.
 
-        Note: If can't find a good location (50 attempts), then return an empty dict.
+        Note: If can't find a good location (50 attempts, or no valid location in
+        exhaustive mode), then return None.
         """
+        if self.exhaustive:
+            return self._exhaustive_location()
         for _ in range(50):
-            obj_loc_dic = self._random_location_dic()
-            obj_loc = obj_loc_dic.keys()
-            is_conflict = sum([not all(self.segmented_image[i]) for i in obj_loc]) != 0
+            self.attempt_n += 1
+            obj_loc = self._random_location()
+            is_conflict = _box_sum(self.fore_integral, *obj_loc) != 0
             cond = not is_conflict if self.by_conflict else is_conflict
             if cond:
                 continue
             else:
-                return obj_loc_dic
+                return obj_loc
         else:
-            return {}
+            return None
 
     @property
-    @lru_cache
+    def obj_slice(self) -> tuple[slice, slice]:
+        """The object location as a slice of the image."""
+        y, x, h, w = self.obj_loc
+        return slice(y, y + h), slice(x, x + w)
+
+    @cached_property
     def bbox(self) -> list:
         """The bounding box with format `XYXY`"""
-        if self.obj_loc_dic == {}:
+        if self.obj_loc is None:
             return []
         else:
-            loc = self.obj_loc_dic.keys()
-            ys, xs = [i[0] for i in loc], [i[1] for i in loc]
-            x_min, y_min, x_max, y_max = min(xs), min(ys), max(xs), max(ys)
+            y, x, h, w = self.obj_loc
             ann_label = 0 if self.ann == "inscription" else 1
-            return [ann_label, x_min, y_min, x_max, y_max]
-
-    @property
-    @lru_cache
-    def obj_mask_dic(self) -> dict[tuple[int], NDArray[np.uint8]]:
-        """The object mask location dic of the image."""
+            return [ann_label, x, y, x + w - 1, y + h - 1]
 
-        def is_white(pixel: NDArray[np.uint8]) -> bool:
-            """The shape of pixel must be (3,)"""
-            return all(pixel == 255)
+    @cached_property
+    def obj_mask(self) -> NDArray[bool]:
+        """The object mask (non-white pixels), local to the object bbox."""
+        if self._obj_mask is not None:
+            return self._obj_mask
+        return non_white_mask(self.obj)
 
-        return {k: v for k, v in self.obj_loc_dic.items() if not is_white(v)}
-
-    @staticmethod
-    def _assign_val_based_dic(
-        img, obj_dic: dict[tuple[int], NDArray[np.uint8]]
-    ) -> None:
-        for k, v in obj_dic.items():
-            img[k] = v
-        return None
+    @cached_property
+    def local_mask(self) -> LocalMask | None:
+        """Mask with the object random pasted, local to the object bbox."""
+        if self.obj_loc is None:
+            return None
+        return LocalMask(self.obj_loc, self.obj_mask)
 
     @property
-    @lru_cache
     def mask(self) -> NDArray[np.uint8]:
-        """Mask with the object random pasted"""
-        mask = np.zeros(self.img.shape, dtype=np.uint8)
-        obj_mask_dic_white = {k: [255, 255, 255] for k in self.obj_mask_dic.keys()}
-        self._assign_val_based_dic(mask, obj_mask_dic_white)
-        return mask
+        """Mask with the object random pasted (full size, not cached)."""
+        if self.local_mask is None:
+            return np.zeros(self.img.shape, dtype=np.uint8)
+        return self.local_mask.dense(self.img.shape)
 
-    @property
-    @lru_cache
+    @cached_property
+    def rle(self) -> dict | None:
+        """
+        The object mask of the image as COCO compressed RLE (with `counts` decoded to
+        str, so it's JSON serializable), or None if the object isn't pasted.
+        """
+        if self.local_mask is None:
+            return None
+        return self.local_mask.rle(*self.img.shape[:2])
+
+    @cached_property
     def img_pasted(self) -> NDArray[np.int8]:
         """Image with the object random pasted."""
         img_pasted = self.img.copy()
-        self._assign_val_based_dic(img_pasted, self.obj_mask_dic)
+        if self.obj_loc is not None:
+            img_pasted[self.obj_slice][self.obj_mask] = self.obj[self.obj_mask]
         return img_pasted
 
 
@@ -148,18 +322,29 @@ class PaintingObjMulti:
         obj_multi: list[NDArray[np.uint8]],
         ann_multi: list[int],
         by_conflict_ratio: float,
+        exhaustive: bool = False,
+        obj_mask_multi: list[NDArray[bool]] | None = None,
     ) -> None:
         """
         `ann_multi` could be list consist of 0 (ins) or 1 (seal). 
         The `by_conflict_ratio` parameter specifies the proportion of objects to be
         pasted such that they conflict with the foreground of the image.
+        If `exhaustive` is True, each object is placed by sampling from all its valid
+        locations (see `PaintingObj`). `obj_mask_multi` are the objects' precomputed
+        non-white masks.
         """
         self.img = img
         self.obj_multi = obj_multi
         self.ann_multi = ann_multi
         self.by_conflict_ratio = by_conflict_ratio
+        self.exhaustive = exhaustive
+        self.obj_mask_multi = obj_mask_multi
 
     def random_paste(self) -> None:
+        """
+        Paste the objects one by one. The masks of the pasted objects are kept local to
+        their bbox (`mask_multi`), `mask` is their union.
+        """
         # random generate `by_conflict_multi`
         conflict_n = int(len(self.obj_multi) * self.by_conflict_ratio)
         not_conflict_n = len(self.obj_multi) - conflict_n
@@ -167,20 +352,83 @@ class PaintingObjMulti:
         random.shuffle(by_conflict_multi)
 
         self.img_pasted = self.img.copy()
+        # segmented once, then updated around each pasted object
+        segmentation = IncrementalSegmentation(self.img)
         self.bbox_multi = []
         self.mask_multi = []
+        # union of the object masks
+        self.mask_union = np.zeros(self.img.shape[:2], dtype=bool)
+        # 0 for background, `i` for the `i`-th pasted object
+        self.instance_map = np.zeros(self.img.shape[:2], dtype=np.uint16)
+        self.attempt_n = 0
+        self.drop_n = 0
 
         for i, obj in enumerate(self.obj_multi):
+            obj_mask = None if self.obj_mask_multi is None else self.obj_mask_multi[i]
             painting_obj = PaintingObj(self.img_pasted, obj, self.ann_multi[i],
-                                       by_conflict_multi[i])
-            if painting_obj.bbox == []:
+                                       by_conflict_multi[i], self.exhaustive, obj_mask,
+                                       segmentation.segmented)
+            bbox = painting_obj.bbox
+            self.attempt_n += painting_obj.attempt_n
+            if bbox == []:
+                self.drop_n += 1
                 print("[INFO] Dropped one object as it couldn't fit in the image")
                 continue
-            self.img_pasted = painting_obj.img_pasted
-            self.bbox_multi.append(painting_obj.bbox)
-            self.mask_multi.append(painting_obj.mask)
+            local_mask = painting_obj.local_mask
+            # paste in place, `painting_obj` is done with the image
+            self.img_pasted[local_mask.slice][local_mask.patch] = obj[local_mask.patch]
+            segmentation.update(self.img_pasted, *local_mask.loc)
+            self.bbox_multi.append(bbox)
+            self.mask_multi.append(local_mask)
+            self.mask_union[local_mask.slice] |= local_mask.patch
+            self.instance_map[local_mask.slice][local_mask.patch] = len(self.bbox_multi)
 
-        self.mask = sum(self.mask_multi)
-        if self.mask_multi != []:
-            self.mask[self.mask != 0] = 255
+        self.mask = np.zeros(self.img.shape, dtype=np.uint8)
+        self.mask[self.mask_union] = 255
         return None
+
+    def coco_annotations(self) -> list[dict]:
+        """
+        The pasted objects as COCO annotations (without `id` and `image_id`), with
+        segmentation in compressed RLE (encoded from the local masks). Call after
+        `random_paste`.
+        """
+        img_h, img_w = self.img.shape[:2]
+        anns = []
+        for bbox, local_mask in zip(self.bbox_multi, self.mask_multi):
+            ann, x_min, y_min, x_max, y_max = bbox
+            rle = local_mask.rle(img_h, img_w)
+            # same `XYWH` as computed from the bboxes txt by `create_coco_json`
+            anns.append({
+                "category_id": ann,
+                "bbox": [x_min, y_min, x_max - x_min, y_max - y_min],
+                "area": float(mask_utils.area(rle)),
+                "segmentation": rle,
+                "iscrowd": 0,
+            })
+        return anns
+
+
+def random_paste_from_bank(
+    img: NDArray[np.uint8],
+    obj_bank,
+    seal_max_num: int,
+    ins_max_num: int,
+    by_conflict_ratio: float = 0.2,
+    exhaustive: bool = False,
+) -> PaintingObjMulti:
+    """
+    Random paste 1..`seal_max_num` seals and 1..`ins_max_num` inscriptions sampled from
+    `obj_bank` (an `ObjectBank`) to a painting, with the global `random` state.
+    """
+    seal_ids_sel = obj_bank.sample("seal", random.randint(1, seal_max_num))
+    ins_ids_sel = obj_bank.sample("inscription", random.randint(1, ins_max_num))
+    obj_ids_sel = seal_ids_sel + ins_ids_sel
+    objs = [obj_bank.objs[i] for i in obj_ids_sel]
+    obj_masks = [obj_bank.masks[i] for i in obj_ids_sel]
+    anns = [obj_bank.anns[i] for i in obj_ids_sel]
+
+    painting = PaintingObjMulti(img, objs, anns, by_conflict_ratio, exhaustive=exhaustive,
+                                obj_mask_multi=obj_masks)
+    painting.random_paste()
+    return painting
@@ -1,8 +1,107 @@
 import os
+import hashlib
+import numpy as np
 from os.path import join
 from pathlib import Path
+from numpy.typing import NDArray
 from pycocotools.coco import COCO
 
+CATEGORY_DIC = {1: "seals", 0: "inscriptions"}
+
+
+class AnnotationIndex:
+    """
+    Seal/inscription bounding boxes of a COCO json, indexed by image file name and
+    category, built in a single pass over the annotations.
+    """
+
+    def __init__(
+        self,
+        names: list[str],
+        ann_image_idx: NDArray[np.int64],
+        ann_category: NDArray[np.int64],
+        ann_bbox: NDArray[np.float64],
+    ) -> None:
+        """
+        `names` are the file names of all the images. Each annotation is represented by
+        the index of its image in `names`, its category id and its bbox (`XYWH`).
+        """
+        self.names = names
+        self.ann_image_idx = ann_image_idx
+        self.ann_category = ann_category
+        self.ann_bbox = ann_bbox
+        # group the annotations by (image, category), then slice each group once
+        order = np.lexsort((ann_category, ann_image_idx))
+        keys = np.stack([ann_image_idx[order], ann_category[order]], axis=-1)
+        starts = np.flatnonzero(np.any(np.diff(keys, axis=0, prepend=-1) != 0, axis=-1))
+        ends = np.append(starts[1:], len(order))
+        self.boxes_dic = {
+            (names[keys[s, 0]], CATEGORY_DIC[keys[s, 1]]): ann_bbox[order[s:e]]
+            for s, e in zip(starts, ends)
+            if keys[s, 1] in CATEGORY_DIC
+        }
+        self.names_with_anns = [names[i] for i in np.unique(ann_image_idx)]
+        self._names_with_anns = set(self.names_with_anns)
+
+    @classmethod
+    def from_coco(cls, coco: COCO) -> "AnnotationIndex":
+        ids = list(coco.imgs.keys())
+        names = [Path(coco.imgs[i]["file_name"]).name for i in ids]
+        anns = [(idx, ann) for idx, i in enumerate(ids) for ann in coco.imgToAnns[i]]
+        return cls(
+            names,
+            np.array([idx for idx, _ in anns], dtype=np.int64),
+            np.array([ann["category_id"] for _, ann in anns], dtype=np.int64),
+            np.array([ann["bbox"] for _, ann in anns], dtype=np.float64).reshape(-1, 4),
+        )
+
+    @classmethod
+    def from_coco_json(
+        cls, coco_json_path: str, cache_dir: str | None = None
+    ) -> "AnnotationIndex":
+        """
+        Load the index of a COCO json, cached as `{json_stem}-{json_hash}.npz` in
+        `cache_dir` (default: the json's directory).
+        """
+        with open(coco_json_path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()[:16]
+        cache_dir = Path(coco_json_path).parent if cache_dir is None else Path(cache_dir)
+        cache_path = cache_dir / f"{Path(coco_json_path).stem}-{digest}.npz"
+        if cache_path.exists():
+            return cls.load(cache_path)
+        index = cls.from_coco(COCO(coco_json_path))
+        os.makedirs(cache_dir, exist_ok=True)
+        index.save(cache_path)
+        return index
+
+    def save(self, path: str) -> None:
+        np.savez(
+            path,
+            names=np.array(self.names, dtype=str),
+            ann_image_idx=self.ann_image_idx,
+            ann_category=self.ann_category,
+            ann_bbox=self.ann_bbox,
+        )
+        return None
+
+    @classmethod
+    def load(cls, path: str) -> "AnnotationIndex":
+        with np.load(path) as f:
+            return cls(
+                f["names"].tolist(), f["ann_image_idx"], f["ann_category"], f["ann_bbox"]
+            )
+
+    def has_anns(self, name: str) -> bool:
+        """Whether the image has seals/inscriptions."""
+        return name in self._names_with_anns
+
+    def boxes(self, name: str, obj: str) -> NDArray[np.float64]:
+        """
+        Bounding boxes (`XYWH`, shape (n, 4)) of the image for `obj`, which can be
+        'seals' or 'inscriptions'.
+        """
+        return self.boxes_dic.get((name, obj), np.empty((0, 4)))
+
 
 def get_boxes_dic(coco_json_path: str):
     """
@@ -14,18 +113,8 @@ def get_boxes_dic(coco_json_path: str):
         ...
     }
     """
-    coco = COCO(coco_json_path)
-    images_id_name_dic = {
-        v["id"]: Path(v["file_name"]).name for v in coco.imgs.values()
+    index = AnnotationIndex.from_coco_json(coco_json_path)
+    return {
+        name: {v: index.boxes(name, v).tolist() for v in CATEGORY_DIC.values()}
+        for name in index.names_with_anns
     }
-    images_id_which_has_si = set([v["image_id"] for v in coco.anns.values()])
-
-    def get_box_dic_part(image_id):
-        anns_single = [v for v in coco.anns.values() if v["image_id"] == image_id]
-        category_dic = {1: "seals", 0: "inscriptions"}
-        return {
-            v: [i["bbox"] for i in anns_single if i["category_id"] == k]
-            for k, v in category_dic.items()
-        }
-
-    return {images_id_name_dic[i]: get_box_dic_part(i) for i in images_id_which_has_si}
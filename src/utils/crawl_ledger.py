@@ -0,0 +1,168 @@
+import os
+import csv
+import time
+import hashlib
+import sqlite3
+
+# 'pending': to be crawled again, 'claimed': being crawled by a worker,
+# 'done': image downloaded, 'none': page without download botton, 'failed': gave up.
+STATUSES = ("pending", "claimed", "done", "none", "failed")
+
+
+class CrawlLedger:
+    """
+    Crawl state of every pid, in a SQLite database (WAL mode) shared by the crawler
+    workers. Each pid is claimed and recorded in its own transaction.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS crawl (
+                pid INTEGER PRIMARY KEY,
+                status TEXT NOT NULL,
+                dpi INTEGER,
+                filename TEXT,
+                size INTEGER,
+                sha256 TEXT,
+                worker TEXT,
+                updated REAL
+            );
+            CREATE INDEX IF NOT EXISTS crawl_status ON crawl (status);
+            CREATE INDEX IF NOT EXISTS crawl_filename ON crawl (filename);
+            """
+        )
+
+    def close(self):
+        self.conn.close()
+
+    def max_pid(self):
+        """Max pid in the ledger (0 if empty)."""
+        return self.conn.execute("SELECT coalesce(max(pid), 0) FROM crawl").fetchone()[0]
+
+    def claim(self, n, worker, max_pid, timeout=None):
+        """
+        Atomically claim up to `n` pids for `worker`: 'pending' pids first, then the
+        pids after the max pid of the ledger, up to `max_pid`. If `timeout` is given,
+        the pids of other workers claimed or started (see `start`) more than `timeout`
+        seconds ago (by a worker which was killed before releasing them) are set back
+        to 'pending' first.
+        """
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            if timeout is not None:
+                self.conn.execute(
+                    "UPDATE crawl SET status = 'pending' WHERE status = 'claimed' "
+                    "AND updated < ? AND worker != ?",
+                    (time.time() - timeout, worker),
+                )
+            pids = [
+                row[0]
+                for row in self.conn.execute(
+                    "SELECT pid FROM crawl WHERE status = 'pending' ORDER BY pid LIMIT ?",
+                    (n,),
+                )
+            ]
+            start = self.max_pid() + 1
+            pids_new = list(range(start, min(start + n - len(pids), max_pid + 1)))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO crawl (pid, status, worker, updated) "
+                "VALUES (?, 'claimed', ?, ?)",
+                [(pid, worker, time.time()) for pid in pids + pids_new],
+            )
+        return pids + pids_new
+
+    def start(self, pid, worker):
+        """
+        Refresh the claim of a pid by `worker` when its crawl actually starts (it may
+        have waited in a queue since claimed). Return False if the pid was claimed
+        again by another worker meanwhile, so it must not be crawled.
+        """
+        with self.conn:
+            cursor = self.conn.execute(
+                "UPDATE crawl SET updated = ? WHERE pid = ? AND status = 'claimed' "
+                "AND worker = ?",
+                (time.time(), pid, worker),
+            )
+        return cursor.rowcount == 1
+
+    def record(self, pid, status, dpi=None, filename=None, size=None, sha256=None):
+        """Record the result of a pid."""
+        assert status in STATUSES
+        with self.conn:
+            self.conn.execute(
+                "UPDATE crawl SET status = ?, dpi = ?, filename = ?, size = ?, sha256 = ?, "
+                "updated = ? WHERE pid = ?",
+                (status, dpi, filename, size, sha256, time.time(), pid),
+            )
+
+    def release(self, worker=None, status="claimed"):
+        """
+        Set the pids with `status` (of `worker`, default: of all workers) back to
+        'pending', e.g. claims of a killed worker or failed pids to retry.
+        """
+        sql = "UPDATE crawl SET status = 'pending' WHERE status = ?"
+        params = (status,) if worker is None else (status, worker)
+        with self.conn:
+            self.conn.execute(sql if worker is None else sql + " AND worker = ?", params)
+
+    def counts(self):
+        """Number of pids of each status."""
+        return dict(self.conn.execute("SELECT status, count(*) FROM crawl GROUP BY status"))
+
+    def check(self, images_dir):
+        """
+        Check the ledger against the images directory, return `(gaps, missing,
+        extra)`: pids absent from the ledger below its max pid, recorded images which
+        are absent or of a different size, and images not recorded (except '.part'
+        files being downloaded).
+        """
+        pids = {row[0] for row in self.conn.execute("SELECT pid FROM crawl")}
+        gaps = set(range(1, self.max_pid() + 1)) - pids
+        sizes = {
+            i.name: i.stat().st_size
+            for i in os.scandir(images_dir)
+            if i.is_file() and not i.name.endswith(".part")  # being downloaded
+        }
+        recorded = dict(
+            self.conn.execute("SELECT filename, size FROM crawl WHERE status = 'done'")
+        )
+        missing = {k for k, v in recorded.items() if sizes.get(k) != v}
+        extra = set(sizes) - set(recorded)
+        return sorted(gaps), missing, extra
+
+    def import_map_csv(self, map_csv_path, images_dir):
+        """
+        Import the 'map.csv' of `NPMCrawler`, computing the size and checksum of each
+        image. Images absent from `images_dir` are imported as 'pending'.
+        """
+        with open(map_csv_path, "r") as f:
+            rows = list(csv.reader(f))
+        with self.conn:
+            self.conn.execute("BEGIN")
+            for pid, filename in rows:
+                path = os.path.join(images_dir, filename)
+                if filename == "None":
+                    values = (int(pid), "none", None, None, None)
+                elif os.path.exists(path):
+                    values = (int(pid), "done", filename, *file_size_sha256(path))
+                else:
+                    values = (int(pid), "pending", None, None, None)
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO crawl "
+                    "(pid, status, filename, size, sha256, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                    (*values, time.time()),
+                )
+
+
+def file_size_sha256(path):
+    """Size and SHA-256 of a file."""
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(chunk)
+    return os.path.getsize(path), sha256.hexdigest()
@@ -0,0 +1,127 @@
+import numpy as np
+import torch
+from pycocotools import mask as mask_utils
+from PIL import Image
+from detectron2 import model_zoo
+from detectron2.checkpoint import DetectionCheckpointer
+from detectron2.config import get_cfg
+from detectron2.data import transforms as T
+from detectron2.export import TracingAdapter
+from detectron2.modeling import build_model
+from utils.io import open_image
+
+
+def get_inference_cfg(weights, score_thresh=0.7, device="cpu"):
+    """The config trained by `7-segmentation.py`, for inference with `weights`."""
+    cfg = get_cfg()
+    cfg.merge_from_file(
+        model_zoo.get_config_file("COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_1x.yaml")
+    )
+    cfg.INPUT.MASK_FORMAT = "bitmask"
+    cfg.MODEL.ROI_HEADS.NUM_CLASSES = 2
+    cfg.MODEL.WEIGHTS = weights
+    cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST = score_thresh
+    cfg.MODEL.DEVICE = device
+    return cfg
+
+
+class BatchPredictor:
+    """
+    Like detectron2's `DefaultPredictor`, but the model runs on batches of inputs, and
+    inputs are prepared separately (e.g. by prefetching threads) by `load` or `prepare`.
+    """
+
+    def __init__(self, cfg) -> None:
+        self.cfg = cfg.clone()
+        self.model = build_model(self.cfg)
+        self.model.eval()
+        DetectionCheckpointer(self.model).load(cfg.MODEL.WEIGHTS)
+        self.min_size = cfg.INPUT.MIN_SIZE_TEST
+        self.max_size = cfg.INPUT.MAX_SIZE_TEST
+        self.input_format = cfg.INPUT.FORMAT
+
+    def _to_input(self, image, height, width) -> dict:
+        # the model takes `image` (CHW, resized) and the size to predict at
+        if self.input_format == "BGR":
+            image = image[:, :, ::-1]
+        image = torch.as_tensor(np.ascontiguousarray(image.transpose(2, 0, 1)))
+        return {"image": image, "height": height, "width": width}
+
+    def prepare(self, img) -> dict:
+        """Model input of an RGB image (predictions at the size of `img`)."""
+        height, width = img.shape[:2]
+        new_h, new_w = T.ResizeShortestEdge.get_output_shape(
+            height, width, self.min_size, self.max_size
+        )
+        image = T.ResizeTransform(height, width, new_h, new_w).apply_image(img)
+        return self._to_input(image, height, width)
+
+    def load(self, path) -> dict:
+        """
+        Model input of an image file (predictions at its original size), decoded at
+        reduced size (JPEG DCT scaling) when it's larger than the model input.
+        """
+        with open_image(path) as img:
+            width, height = img.size
+            new_h, new_w = T.ResizeShortestEdge.get_output_shape(
+                height, width, self.min_size, self.max_size
+            )
+            img.draft("RGB", (new_w, new_h))
+            img = img.convert("RGB").resize((new_w, new_h), Image.Resampling.BILINEAR)
+            image = np.asarray(img)
+        return self._to_input(image, height, width)
+
+    def __call__(self, inputs: list[dict]) -> list:
+        """The predicted `Instances` (on CPU) of a batch of inputs."""
+        with torch.inference_mode():
+            outputs = self.model(inputs)
+        return [i["instances"].to("cpu") for i in outputs]
+
+
+def export_model(predictor, sample_input, export_format, path):
+    """
+    Export the model of `predictor` by tracing it on the image of `sample_input` (from
+    `load` or `prepare`), as TorchScript ('torchscript') or ONNX ('onnx'), for
+    deployment outside detectron2.
+    """
+
+    def inference(model, inputs):
+        instances = model.inference(inputs, do_postprocess=False)[0]
+        return [{"instances": instances}]
+
+    # only tensors can be traced, the output size is the input size (like detectron2's
+    # `tools/deploy/export_model.py`)
+    adapter = TracingAdapter(predictor.model, [{"image": sample_input["image"]}], inference)
+    with torch.no_grad():
+        if export_format == "torchscript":
+            torch.jit.trace(adapter, adapter.flattened_inputs).save(path)
+        elif export_format == "onnx":
+            torch.onnx.export(adapter, adapter.flattened_inputs, path, opset_version=16)
+        else:
+            raise ValueError("Argument 'export_format' must be 'torchscript' or 'onnx'.")
+    return None
+
+
+def encode_instances(instances) -> list[dict]:
+    """
+    COCO-style results (`XYWH` bbox, compressed RLE segmentation with `counts` as str)
+    of predicted `Instances`.
+    """
+    if len(instances) == 0:
+        return []
+    boxes = instances.pred_boxes.tensor.numpy()
+    masks = np.asfortranarray(instances.pred_masks.numpy().transpose(1, 2, 0).astype(np.uint8))
+    rles = mask_utils.encode(masks)
+    results = []
+    for box, score, category, rle in zip(
+        boxes, instances.scores.tolist(), instances.pred_classes.tolist(), rles
+    ):
+        x_min, y_min, x_max, y_max = box.tolist()
+        rle["counts"] = rle["counts"].decode("ascii")
+        results.append({
+            "category_id": category,
+            "score": round(score, 4),
+            "bbox": [round(i, 2) for i in [x_min, y_min, x_max - x_min, y_max - y_min]],
+            "segmentation": rle,
+        })
+    return results
@@ -0,0 +1,155 @@
+import os
+import numpy as np
+from numpy.typing import NDArray
+from scipy import ndimage
+
+
+class LamaInpainter:
+    """
+    LaMa model (https://github.com/advimman/lama) kept resident, to inpaint batches of
+    images. Needs the lama repo in `PYTHONPATH` (see `8-inpainting.md`), so torch and
+    lama are imported here rather than by the module.
+    """
+
+    def __init__(self, model_dir: str, device: str = "cpu") -> None:
+        """`model_dir` is like `big-lama` (`config.yaml` and `models/best.ckpt`)."""
+        import yaml
+        from omegaconf import OmegaConf
+        from saicinpainting.training.trainers import load_checkpoint
+
+        with open(os.path.join(model_dir, "config.yaml")) as f:
+            train_config = OmegaConf.create(yaml.safe_load(f))
+        train_config.training_model.predict_only = True
+        train_config.visualizer.kind = "noop"
+        checkpoint_path = os.path.join(model_dir, "models", "best.ckpt")
+        self.model = load_checkpoint(train_config, checkpoint_path, strict=False,
+                                     map_location="cpu")
+        self.model.freeze()
+        self.model.to(device)
+        self.device = device
+
+    def __call__(self, images: NDArray[np.uint8], masks: NDArray[bool]) -> NDArray[np.uint8]:
+        """
+        Inpaint a batch of RGB images `(n, h, w, 3)` (`h` and `w` multiples of 8) where
+        `masks` `(n, h, w)` are True. The raw predictions are returned, also outside the
+        masks, to be blended by the caller.
+        """
+        import torch
+
+        batch = {
+            "image": torch.from_numpy(images).permute(0, 3, 1, 2).float().div(255),
+            "mask": torch.from_numpy(masks[:, None].astype(np.float32)),
+        }
+        with torch.inference_mode():
+            batch = self.model({k: v.to(self.device) for k, v in batch.items()})
+        predicted = batch["predicted_image"].permute(0, 2, 3, 1).cpu().numpy()
+        return np.clip(predicted * 255, 0, 255).round().astype(np.uint8)
+
+
+def group_boxes(boxes: list, pad: int, height: int, width: int) -> list[tuple]:
+    """
+    Group the bboxes (`XYWH`) into crops `(y, x, h, w)`: each bbox padded by `pad` and
+    clipped to the image, then the crops intersecting each other merged until they
+    are disjoint.
+    """
+    crops = []
+    for x, y, w, h in boxes:
+        y0, x0 = max(int(y) - pad, 0), max(int(x) - pad, 0)
+        y1, x1 = min(int(np.ceil(y + h)) + pad, height), min(int(np.ceil(x + w)) + pad, width)
+        crops.append((y0, x0, y1, x1))
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(crops)):
+            for j in range(i + 1, len(crops)):
+                a, b = crops[i], crops[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    crops[i] = (min(a[0], b[0]), min(a[1], b[1]),
+                                max(a[2], b[2]), max(a[3], b[3]))
+                    del crops[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return [(y0, x0, y1 - y0, x1 - x0) for y0, x0, y1, x1 in crops]
+
+
+def feather_alpha(mask: NDArray[bool], feather: int) -> NDArray[np.float32]:
+    """Blending weight of the inpainted pixels: 1 in the mask, fading out over `feather`."""
+    if feather == 0:
+        return mask.astype(np.float32)
+    distance = ndimage.distance_transform_edt(~mask)
+    return np.clip(1 - distance / (feather + 1), 0, 1).astype(np.float32)
+
+
+class CropInpainter:
+    """
+    Inpaint only the regions around the masks of a (full resolution) painting: the
+    masks (dilated by `dilation`) are grouped into crops padded by `pad` for context,
+    the crops are inpainted in batches of `batch_size` by `inpainter` (e.g. a resident
+    `LamaInpainter`), and pasted back blended over `feather` pixels around the masks.
+    """
+
+    def __init__(self, inpainter, pad=128, dilation=7, feather=16, batch_size=4) -> None:
+        if pad < dilation + feather:
+            raise ValueError("Argument 'pad' must be at least 'dilation' + 'feather'.")
+        self.inpainter = inpainter
+        self.pad = pad
+        self.dilation = dilation
+        self.feather = feather
+        self.batch_size = batch_size
+
+    def crops(self, height: int, width: int, boxes: list) -> list[tuple]:
+        """The crops `(y, x, h, w)` inpainted for the bboxes (`XYWH`), see `group_boxes`."""
+        return group_boxes(boxes, self.pad, height, width)
+
+    def _inpaint_batch(self, img, crops, crop_masks) -> list[NDArray[np.uint8]]:
+        # pad the crops to the same size, a multiple of 8, by reflection. The masks are
+        # reflected too, so that objects mirrored in the padding aren't used as context
+        batch_h = -(-max(h for _, _, h, _ in crops) // 8) * 8
+        batch_w = -(-max(w for _, _, _, w in crops) // 8) * 8
+        images = np.zeros((len(crops), batch_h, batch_w, 3), dtype=np.uint8)
+        masks = np.zeros((len(crops), batch_h, batch_w), dtype=bool)
+        for i, ((y, x, h, w), crop_mask) in enumerate(zip(crops, crop_masks)):
+            pad_width = ((0, batch_h - h), (0, batch_w - w))
+            images[i] = np.pad(img[y:y + h, x:x + w], (*pad_width, (0, 0)), mode="symmetric")
+            masks[i] = np.pad(crop_mask, pad_width, mode="symmetric")
+        predicted = self.inpainter(images, masks)
+        return [predicted[i, :h, :w] for i, (_, _, h, w) in enumerate(crops)]
+
+    def __call__(self, img: NDArray[np.uint8], mask: NDArray[bool],
+                 boxes: list) -> NDArray[np.uint8]:
+        """
+        Return the painting inpainted where `mask` is True, given the bboxes (`XYWH`)
+        of the objects of the mask.
+        """
+        img_h, img_w = img.shape[:2]
+        crops = self.crops(img_h, img_w, boxes)
+        # similar sizes in the same batch, to pad less
+        crops.sort(key=lambda i: i[2] * i[3])
+        cleaned = img.copy()
+        for i in range(0, len(crops), self.batch_size):
+            batch_crops = crops[i:i + self.batch_size]
+            crop_masks = []
+            for y, x, h, w in batch_crops:
+                crop_mask = mask[y:y + h, x:x + w]
+                if self.dilation > 0:
+                    crop_mask = ndimage.binary_dilation(crop_mask, iterations=self.dilation)
+                crop_masks.append(crop_mask)
+            predicted = self._inpaint_batch(img, batch_crops, crop_masks)
+            for (y, x, h, w), crop_mask, crop_pred in zip(batch_crops, crop_masks, predicted):
+                alpha = feather_alpha(crop_mask, self.feather)[:, :, None]
+                crop = img[y:y + h, x:x + w].astype(np.float32)
+                blended = alpha * crop_pred + (1 - alpha) * crop
+                cleaned[y:y + h, x:x + w] = np.clip(blended.round(), 0, 255).astype(np.uint8)
+        return cleaned
+
+
+def inpaint_whole(inpainter, img: NDArray[np.uint8], mask: NDArray[bool]) -> NDArray[np.uint8]:
+    """Inpaint the whole painting at once (like lama's `bin/predict.py`), as a baseline."""
+    img_h, img_w = img.shape[:2]
+    pad_width = ((0, -(-img_h // 8) * 8 - img_h), (0, -(-img_w // 8) * 8 - img_w))
+    image = np.pad(img, (*pad_width, (0, 0)), mode="symmetric")[None]
+    padded_mask = np.pad(mask, pad_width, mode="symmetric")
+    predicted = inpainter(image, padded_mask[None])[0, :img_h, :img_w]
+    return np.where(mask[:, :, None], predicted, img)
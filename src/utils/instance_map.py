@@ -0,0 +1,70 @@
+import json
+import numpy as np
+from numpy.typing import NDArray
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+
+def _bit_planes(instance_map: NDArray[np.uint16]) -> NDArray[np.uint8]:
+    """Bit-pack an instance map into as many bit planes as the largest id needs."""
+    bits = max(int(instance_map.max()).bit_length(), 1)
+    planes = (instance_map[None] >> np.arange(bits, dtype=np.uint16)[:, None, None]) & 1
+    return np.packbits(planes.astype(bool), axis=-1)
+
+
+def _from_bit_planes(planes: NDArray[np.uint8], width: int) -> NDArray[np.uint16]:
+    bits = np.unpackbits(planes, axis=-1, count=width).astype(np.uint16)
+    return (bits << np.arange(len(planes), dtype=np.uint16)[:, None, None]).sum(
+        axis=0, dtype=np.uint16
+    )
+
+
+def save_instance_map(path: str, instance_map: NDArray[np.uint16], categories: list[int]) -> None:
+    """
+    Save the instance map of a painting (0 for background, `i` for the `i`-th object)
+    with its category table (`categories[i - 1]` is the category of the `i`-th object,
+    0 (ins) or 1 (seal)).
+
+    The format depends on the extension of `path`: '.npz' (bit-packed id planes,
+    compressed) or '.png' (16-bit grayscale, categories in a text chunk).
+    """
+    categories = [int(i) for i in categories]
+    if path.endswith(".npz"):
+        np.savez_compressed(
+            path,
+            planes=_bit_planes(instance_map),
+            shape=np.array(instance_map.shape),
+            categories=np.array(categories, dtype=np.uint8),
+        )
+    elif path.endswith(".png"):
+        info = PngInfo()
+        info.add_text("categories", json.dumps(categories))
+        Image.fromarray(instance_map.astype(np.uint16)).save(path, pnginfo=info)
+    else:
+        raise ValueError("Argument 'path' must end with '.npz' or '.png'.")
+    return None
+
+
+def load_instance_map(path: str) -> tuple[NDArray[np.uint16], list[int]]:
+    """Load an instance map and its category table saved by `save_instance_map`."""
+    if path.endswith(".npz"):
+        with np.load(path) as data:
+            instance_map = _from_bit_planes(data["planes"], int(data["shape"][1]))
+            return instance_map, data["categories"].tolist()
+    with Image.open(path) as img:
+        categories = json.loads(img.text["categories"])
+        return np.asarray(img).astype(np.uint16), categories
+
+
+def lama_mask(instance_map: NDArray[np.uint16]) -> NDArray[np.uint8]:
+    """The binary mask of all the objects (255), as the inpainting input."""
+    return np.where(instance_map != 0, 255, 0).astype(np.uint8)
+
+
+def instance_masks(instance_map: NDArray[np.uint16], n: int) -> list[NDArray[bool]]:
+    """
+    The masks of the objects `1..n` (`n` is the length of the category table).
+
+    Note: Where objects overlap, the pixels belong to the object pasted last.
+    """
+    return [instance_map == i for i in range(1, n + 1)]
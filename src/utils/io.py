@@ -1,14 +1,160 @@
+import os
+import struct
 from PIL import Image
 import numpy as np
 from numpy.typing import NDArray
 
+# the 600 DPI originals exceed PIL's decompression bomb limit
+Image.MAX_IMAGE_PIXELS = None
+
+
+def open_image(path: str) -> Image.Image:
+    """Open an image lazily (see `Image.open`), without the decompression bomb limit."""
+    return Image.open(path)
+
 
 def read_image(path: str) -> NDArray[np.uint8]:
     img = Image.open(path)
     return np.asarray(img).copy()
 
 
+def read_image_rgb(path: str) -> NDArray[np.uint8]:
+    """Read an image as RGB, whatever its mode (e.g. grayscale, RGBA or CMYK scans)."""
+    with Image.open(path) as img:
+        return np.asarray(img.convert("RGB"))
+
+
 def write_png(path: str, img: NDArray[np.uint8]) -> None:
     img = Image.fromarray(img)
     img.save(path)
     return None
+
+
+def read_image_size(path: str) -> tuple[int, int]:
+    """
+    Size `(width, height)` of an image. For PNG it's read from the IHDR chunk (the
+    first 24 bytes), else from the header parsed by PIL, without decoding the pixels.
+    """
+    with open(path, "rb") as f:
+        head = f.read(24)
+    if head[:8] == b"\x89PNG\r\n\x1a\n" and head[12:16] == b"IHDR":
+        return struct.unpack(">II", head[16:24])
+    with Image.open(path) as img:
+        return img.size
+
+
+def read_image_regions(path: str, regions: list) -> list[NDArray[np.uint8]]:
+    """
+    Read regions (`XYWH`, clipped to the image) of an image with one decode. For tiled
+    or striped sources (e.g. TIFF), only the tiles overlapping the regions are decoded.
+    """
+    with Image.open(path) as img:
+        if len(img.tile) > 1:
+            img.tile = [
+                t for t in img.tile
+                if any(_overlaps(t[1], region) for region in regions)
+            ]
+        img.load()
+        w, h = img.size
+        return [
+            np.array(img.crop((min(x, w), min(y, h), min(x + rw, w), min(y + rh, h))))
+            for x, y, rw, rh in regions
+        ]
+
+
+def _overlaps(extents: tuple, region: tuple) -> bool:
+    """Whether tile extents (`XYXY`) overlap a region (`XYWH`)."""
+    x0, y0, x1, y1 = extents
+    x, y, w, h = region
+    return x0 < x + w and x < x1 and y0 < y + h and y < y1
+
+
+def raw_tiff_chunks(image: Image.Image, max_rows: int = 64) -> list[tuple] | None:
+    """
+    The chunks `(x, y, w, h, offset, byte_count)` (tiles, or strips split into at most
+    `max_rows` rows, in row-major order) of an uncompressed TIFF with interleaved
+    channels, None for other images.
+    """
+    if image.format != "TIFF" or image.tile == [] or image.tile[0][0] != "raw":
+        return None
+    tags = image.tag_v2
+    # compressed, or separate planes
+    if tags.get(259, 1) != 1 or tags.get(284, 1) != 1:
+        return None
+    w, h = image.size
+    if 322 in tags:
+        tile_w, tile_h = tags[322], tags[323]
+        locs = [
+            (x, y, tile_w, tile_h) for y in range(0, h, tile_h) for x in range(0, w, tile_w)
+        ]
+        return [(*loc, offset, n) for loc, offset, n in zip(locs, tags[324], tags[325])]
+    chunks = []
+    rows_per_strip = min(tags.get(278, h), h)
+    # the rows of an uncompressed strip are contiguous, e.g. a whole image in one strip
+    for y, offset, byte_count in zip(range(0, h, rows_per_strip), tags[273], tags[279]):
+        strip_h = min(rows_per_strip, h - y)
+        stride = byte_count // strip_h
+        for i in range(0, strip_h, max_rows):
+            rows = min(max_rows, strip_h - i)
+            chunks.append((0, y + i, w, rows, offset + i * stride, rows * stride))
+    return chunks
+
+
+def read_tiff_chunk(f, mode: str, rawmode: str, chunk: tuple) -> NDArray[np.uint8]:
+    """Decode a chunk (see `raw_tiff_chunks`) of an uncompressed TIFF file as RGB."""
+    _, _, w, h, offset, byte_count = chunk
+    f.seek(offset)
+    pixels = Image.frombytes(mode, (w, h), f.read(byte_count), "raw", rawmode)
+    return np.asarray(pixels.convert("RGB"))
+
+
+class LazyTiff:
+    """
+    An uncompressed TIFF read as RGB by slices like an array (`tiff[y0:y1, x0:x1]`,
+    `tiff[::step, ::step]`), decoding only the chunks overlapping the slice, so the
+    full resolution image is never held (see `read_image_lazy`).
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with Image.open(path) as img:
+            self.chunks = raw_tiff_chunks(img)
+            if self.chunks is None:
+                raise ValueError(f"{path} isn't an uncompressed TIFF")
+            self.mode, self.rawmode = img.mode, img.tile[0][3][0]
+            self.shape = (img.size[1], img.size[0], 3)
+        # a truncated file would only fail when sliced
+        end = max(offset + byte_count for *_, offset, byte_count in self.chunks)
+        if os.path.getsize(path) < end:
+            raise OSError(f"{path} is truncated")
+
+    def __getitem__(self, key: tuple[slice, slice]) -> NDArray[np.uint8]:
+        (y0, y1, step_y), (x0, x1, step_x) = (
+            i.indices(n) for i, n in zip(key, self.shape[:2])
+        )
+        out_h, out_w = len(range(y0, y1, step_y)), len(range(x0, x1, step_x))
+        out = np.zeros((out_h, out_w, 3), dtype=np.uint8)
+        with open(self.path, "rb") as f:
+            for chunk in self.chunks:
+                cx, cy, cw, ch = chunk[:4]
+                # the first pixels of the slice in the chunk
+                sy = max(y0, cy) + (y0 - max(y0, cy)) % step_y
+                sx = max(x0, cx) + (x0 - max(x0, cx)) % step_x
+                ey, ex = min(y1, cy + ch), min(x1, cx + cw)
+                if sy >= ey or sx >= ex:
+                    continue
+                pixels = read_tiff_chunk(f, self.mode, self.rawmode, chunk)
+                pixels = pixels[sy - cy:ey - cy:step_y, sx - cx:ex - cx:step_x]
+                oy, ox = (sy - y0) // step_y, (sx - x0) // step_x
+                out[oy:oy + pixels.shape[0], ox:ox + pixels.shape[1]] = pixels
+        return out
+
+
+def read_image_lazy(path: str) -> NDArray[np.uint8] | LazyTiff:
+    """
+    Read an image as RGB: an uncompressed TIFF lazily (see `LazyTiff`), other images
+    (e.g. JPEG, which can't be decoded by region) fully, like `read_image_rgb`.
+    """
+    with Image.open(path) as img:
+        lazy = raw_tiff_chunks(img) is not None
+    return LazyTiff(path) if lazy else read_image_rgb(path)
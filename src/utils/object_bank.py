@@ -0,0 +1,140 @@
+import os
+import json
+import hashlib
+import random
+import numpy as np
+from numpy.typing import NDArray
+from utils.io import read_image
+from algorithms.random_paste import non_white_mask
+
+
+def _data_offset(header_len: int) -> int:
+    """Offset of the data of a saved bank, aligned to 64 bytes."""
+    return -(-(8 + header_len) // 64) * 64
+
+
+def dir_fingerprint(obj_dir: str) -> str:
+    """SHA-256 of the sorted file names, sizes and modification times of a directory."""
+    sha256 = hashlib.sha256()
+    for name in sorted(os.listdir(obj_dir)):
+        stat = os.stat(os.path.join(obj_dir, name))
+        sha256.update(f"{name}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+    return sha256.hexdigest()
+
+
+class ObjectBank:
+    """
+    Seal/inscription objects (filtered boxes) with their categories and precomputed
+    non-white masks, loaded once to be sampled by random paste.
+
+    The bank can be saved to a single file and memory-mapped back, so that worker
+    processes share the same pages instead of decoding the boxes again.
+    """
+
+    def __init__(
+        self,
+        names: list[str],
+        anns: list[str],
+        objs: list[NDArray[np.uint8]],
+        masks: list[NDArray[bool]],
+        path: str | None = None,
+        source: str | None = None,
+    ) -> None:
+        """
+        `anns` could be 'seal' or 'inscription'. `path` is the file the bank is
+        memory-mapped from, if any. `source` is the `dir_fingerprint` of the directory
+        the objects were loaded from, if any.
+        """
+        self.names = names
+        self.anns = anns
+        self.objs = objs
+        self.masks = masks
+        self.path = path
+        self.source = source
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __reduce__(self):
+        # memory-mapped banks are reopened by path rather than pickled by value
+        if self.path is not None:
+            return ObjectBank.load, (self.path,)
+        return ObjectBank, (self.names, self.anns, self.objs, self.masks, None, self.source)
+
+    @classmethod
+    def from_dir(cls, obj_dir: str) -> "ObjectBank":
+        """
+        Load the objects of a directory like `Seal-Inscription-boxes-filtered-manual`,
+        whose file names are like `{image_name}_seals_1_filtered.png`.
+        """
+        source = dir_fingerprint(obj_dir)
+        names = sorted(os.listdir(obj_dir))
+        anns = [i.split("_")[1][:-1] for i in names]
+        objs = [read_image(os.path.join(obj_dir, i)) for i in names]
+        masks = [non_white_mask(i) for i in objs]
+        return cls(names, anns, objs, masks, source=source)
+
+    @classmethod
+    def from_dir_cached(cls, obj_dir: str, path: str) -> "ObjectBank":
+        """
+        Memory-map the bank of `obj_dir` saved at `path`, which is (re)built first if
+        it doesn't exist or `obj_dir` changed since (see `dir_fingerprint`).
+        """
+        if os.path.exists(path):
+            obj_bank = cls.load(path)
+            if obj_bank.source == dir_fingerprint(obj_dir):
+                return obj_bank
+            print(f"[INFO] {obj_dir} changed, rebuilding {path}")
+        cls.from_dir(obj_dir).save(path)
+        return cls.load(path)
+
+    def save(self, path: str) -> None:
+        """
+        Save the bank to a single file: an 8 bytes header length, a JSON header, then
+        (64 bytes aligned) all the objects' pixels followed by all the masks. The file
+        is replaced atomically, so processes which memory-mapped it keep the old bank.
+        """
+        header = {
+            "names": self.names,
+            "anns": self.anns,
+            "shapes": [list(i.shape) for i in self.objs],
+            "source": self.source,
+        }
+        header_bytes = json.dumps(header).encode()
+        with open(path + ".part", "wb") as f:
+            f.write(len(header_bytes).to_bytes(8, "little"))
+            f.write(header_bytes.ljust(_data_offset(len(header_bytes)) - 8, b"\0"))
+            for obj in self.objs:
+                f.write(np.ascontiguousarray(obj, dtype=np.uint8).tobytes())
+            for mask in self.masks:
+                f.write(np.ascontiguousarray(mask, dtype=bool).tobytes())
+        os.replace(path + ".part", path)
+        return None
+
+    @classmethod
+    def load(cls, path: str) -> "ObjectBank":
+        """Memory-map a bank saved by `save` (read-only)."""
+        with open(path, "rb") as f:
+            header_len = int.from_bytes(f.read(8), "little")
+            header = json.loads(f.read(header_len))
+        offset = _data_offset(header_len)
+        data = np.memmap(path, dtype=np.uint8, mode="r", offset=offset)
+        objs, masks, start = [], [], 0
+        for shape in header["shapes"]:
+            size = int(np.prod(shape))
+            objs.append(data[start : start + size].reshape(shape))
+            start += size
+        for shape in header["shapes"]:
+            size = shape[0] * shape[1]
+            masks.append(data[start : start + size].view(bool).reshape(shape[:2]))
+            start += size
+        return cls(header["names"], header["anns"], objs, masks, path=path,
+                   source=header.get("source"))
+
+    def ids(self, ann: str) -> list[int]:
+        """Indexes of the objects with the given category."""
+        return [i for i, v in enumerate(self.anns) if v == ann]
+
+    def sample(self, ann: str, k: int) -> list[int]:
+        """Randomly sample `k` object indexes of the given category."""
+        return random.sample(self.ids(ann), k)
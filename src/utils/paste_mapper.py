@@ -0,0 +1,76 @@
+# Generate the training samples of detectron2 on the fly: each time a nosi painting is
+# loaded, seals/inscriptions sampled from the object bank are random pasted to it, so
+# every epoch sees new samples without pre-rendering them to disk (stages 5 and 6).
+
+import copy
+import os
+import numpy as np
+import torch
+from detectron2.data import DatasetCatalog, MetadataCatalog
+from detectron2.data import detection_utils as utils
+from detectron2.data import transforms as T
+from detectron2.structures import BitMasks, Instances
+from algorithms.random_paste import random_paste_from_bank
+from utils.io import read_image
+
+
+def register_paste_dataset(name, img_dir):
+    """Register the paintings of `img_dir` (without annotations) as dataset `name`."""
+    img_names = sorted(os.listdir(img_dir))
+    dataset_dicts = [
+        {"file_name": os.path.join(img_dir, i), "image_id": image_id}
+        for image_id, i in enumerate(img_names, start=1)
+    ]
+    DatasetCatalog.register(name, lambda: dataset_dicts)
+    MetadataCatalog.get(name).set(thing_classes=["Inscription", "Seal"])
+
+
+class PasteDatasetMapper:
+    """
+    detectron2 dataset mapper which random pastes objects of an `ObjectBank` to the
+    painting of the dataset dict, and returns the pasted image with its `Instances`
+    (`gt_boxes`, `gt_classes`, `gt_masks` as bitmasks), after the augmentations of
+    `cfg` (like detectron2's `DatasetMapper`).
+
+    Pasting runs in the dataloader workers, which are seeded by detectron2 (the global
+    `random` state is used). Give a memory-mapped bank (`ObjectBank.load`), so the
+    workers share it instead of pickling the objects.
+    """
+
+    def __init__(self, cfg, obj_bank, is_train=True, seal_max_num=8, ins_max_num=4,
+                 by_conflict_ratio=0.2, exhaustive=False):
+        self.augmentations = T.AugmentationList(utils.build_augmentation(cfg, is_train))
+        self.image_format = cfg.INPUT.FORMAT
+        self.obj_bank = obj_bank
+        self.seal_max_num = seal_max_num
+        self.ins_max_num = ins_max_num
+        self.by_conflict_ratio = by_conflict_ratio
+        self.exhaustive = exhaustive
+
+    def __call__(self, dataset_dict):
+        dataset_dict = copy.deepcopy(dataset_dict)
+        img = read_image(dataset_dict["file_name"])
+        painting = random_paste_from_bank(
+            img, self.obj_bank, self.seal_max_num, self.ins_max_num,
+            self.by_conflict_ratio, self.exhaustive,
+        )
+        image = painting.img_pasted
+        if self.image_format == "BGR":
+            image = image[:, :, ::-1]
+        dataset_dict["height"], dataset_dict["width"] = image.shape[:2]
+
+        aug_input = T.AugInput(image)
+        transforms = self.augmentations(aug_input)
+        image = aug_input.image
+        # all the instances are transformed at once as their id map (at most 255 objects)
+        instance_map = transforms.apply_segmentation(painting.instance_map.astype(np.uint8))
+        ids = np.arange(1, len(painting.bbox_multi) + 1, dtype=np.uint8)
+
+        instances = Instances(image.shape[:2])
+        instances.gt_classes = torch.tensor([i[0] for i in painting.bbox_multi], dtype=torch.int64)
+        instances.gt_masks = BitMasks(torch.from_numpy(instance_map[None] == ids[:, None, None]))
+        # boxes of the visible (not covered by later pastes) pixels
+        instances.gt_boxes = instances.gt_masks.get_bounding_boxes()
+        dataset_dict["instances"] = utils.filter_empty_instances(instances)
+        dataset_dict["image"] = torch.as_tensor(np.ascontiguousarray(image.transpose(2, 0, 1)))
+        return dataset_dict
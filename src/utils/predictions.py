@@ -0,0 +1,23 @@
+import os
+import json
+
+
+def read_predicted(output_path):
+    """
+    Return the file names already predicted in the JSON lines file `output_path`
+    (see `9-batch_inference.py`), truncating the line which was being written if the
+    last run was interrupted.
+    """
+    predicted = set()
+    if not os.path.exists(output_path):
+        return predicted
+    with open(output_path, "rb+") as f:
+        offset = 0
+        for line in f:
+            try:
+                predicted.add(json.loads(line)["file_name"])
+            except ValueError:
+                break
+            offset += len(line)
+        f.truncate(offset)
+    return predicted
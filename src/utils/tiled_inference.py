@@ -0,0 +1,148 @@
+import numpy as np
+from numpy.typing import NDArray
+from algorithms.random_paste import LocalMask, _box_sum, _integral_image, _segment_fore_back
+from utils.io import LazyTiff
+
+
+def tile_origins(length: int, tile: int, overlap: int) -> list[int]:
+    """Origins of the windows of size `tile` overlapping by `overlap` along a side."""
+    if length <= tile:
+        return [0]
+    return list(range(0, length - tile, tile - overlap)) + [length - tile]
+
+
+def _overlap(a: LocalMask, b: LocalMask) -> int:
+    """Number of pixels in both masks."""
+    ay, ax, ah, aw = a.loc
+    by, bx, bh, bw = b.loc
+    y0, y1 = max(ay, by), min(ay + ah, by + bh)
+    x0, x1 = max(ax, bx), min(ax + aw, bx + bw)
+    if y0 >= y1 or x0 >= x1:
+        return 0
+    a_patch = a.patch[y0 - ay:y1 - ay, x0 - ax:x1 - ax]
+    b_patch = b.patch[y0 - by:y1 - by, x0 - bx:x1 - bx]
+    return int((a_patch & b_patch).sum())
+
+
+def _union(a: LocalMask, b: LocalMask) -> LocalMask:
+    ay, ax, ah, aw = a.loc
+    by, bx, bh, bw = b.loc
+    y, x = min(ay, by), min(ax, bx)
+    h, w = max(ay + ah, by + bh) - y, max(ax + aw, bx + bw) - x
+    patch = np.zeros((h, w), dtype=bool)
+    patch[ay - y:ay - y + ah, ax - x:ax - x + aw] |= a.patch
+    patch[by - y:by - y + bh, bx - x:bx - x + bw] |= b.patch
+    return LocalMask((y, x, h, w), patch)
+
+
+def merge_instances(instances: list[dict], iou_thresh: float = 0.5,
+                    iomin_thresh: float = 0.8) -> list[dict]:
+    """
+    Merge the instances predicted by overlapping tiles: from the highest score, an
+    instance is merged into a kept one of the same category if their mask IoU is above
+    `iou_thresh` (the same object seen by two tiles) or the intersection over the
+    smaller mask is above `iomin_thresh` (a part of the object cut by a tile's seam).
+    """
+    merged = []
+    for instance in sorted(instances, key=lambda i: -i["score"]):
+        for kept in merged:
+            if kept["category_id"] != instance["category_id"]:
+                continue
+            inter = _overlap(kept["mask"], instance["mask"])
+            if inter == 0:
+                continue
+            iou = inter / (kept["area"] + instance["area"] - inter)
+            iomin = inter / min(kept["area"], instance["area"])
+            if iou >= iou_thresh or iomin >= iomin_thresh:
+                kept["mask"] = _union(kept["mask"], instance["mask"])
+                kept["area"] = int(kept["mask"].patch.sum())
+                break
+        else:
+            merged.append(instance)
+    return merged
+
+
+class TiledPredictor:
+    """
+    Predict a full resolution painting by windows of `tile` pixels overlapping by
+    `overlap`, with a `BatchPredictor` run on batches of `batch_size` windows.
+
+    Windows which are mostly background (less than `min_fore_ratio` of foreground, by
+    the segmentation of random paste on a downscaled image) are skipped. Masks are kept
+    local to their bbox and encoded to RLE without the full-size mask, so apart from the
+    image itself, memory is bounded by a batch of windows and the predicted objects.
+    The image can be a `LazyTiff` (see `read_image_lazy`), whose windows are decoded
+    when predicted, so that the full resolution image isn't held at all.
+    """
+
+    def __init__(self, predictor, tile=800, overlap=200, batch_size=4, min_fore_ratio=0.001,
+                 fore_size=1024, iou_thresh=0.5, iomin_thresh=0.8) -> None:
+        self.predictor = predictor
+        self.tile = tile
+        self.overlap = overlap
+        self.batch_size = batch_size
+        self.min_fore_ratio = min_fore_ratio
+        self.fore_size = fore_size
+        self.iou_thresh = iou_thresh
+        self.iomin_thresh = iomin_thresh
+
+    def windows(self, img: NDArray[np.uint8] | LazyTiff) -> list[tuple[int, int, int, int]]:
+        """The windows `(y, x, h, w)` of the image which aren't mostly background."""
+        img_h, img_w = img.shape[:2]
+        # segment a downscaled image, with the longer side about `fore_size`
+        factor = max(max(img_h, img_w) // self.fore_size, 1)
+        fore_integral = _integral_image(~_segment_fore_back(img[::factor, ::factor]))
+        windows = []
+        for y in tile_origins(img_h, self.tile, self.overlap):
+            for x in tile_origins(img_w, self.tile, self.overlap):
+                h, w = min(self.tile, img_h), min(self.tile, img_w)
+                # the window in the downscaled image
+                sy, sx = y // factor, x // factor
+                sh, sw = max(-(-h // factor), 1), max(-(-w // factor), 1)
+                sh = min(sh, fore_integral.shape[0] - 1 - sy)
+                sw = min(sw, fore_integral.shape[1] - 1 - sx)
+                if _box_sum(fore_integral, sy, sx, sh, sw) >= self.min_fore_ratio * sh * sw:
+                    windows.append((y, x, h, w))
+        return windows
+
+    def _predict_windows(self, img, windows) -> list[dict]:
+        inputs = [self.predictor.prepare(img[y:y + h, x:x + w]) for y, x, h, w in windows]
+        instances = []
+        for (y, x, _, _), tile_instances in zip(windows, self.predictor(inputs)):
+            masks = tile_instances.pred_masks.numpy()
+            categories = tile_instances.pred_classes.tolist()
+            for mask, score, category in zip(masks, tile_instances.scores.tolist(), categories):
+                rows, cols = np.flatnonzero(mask.any(axis=1)), np.flatnonzero(mask.any(axis=0))
+                if rows.size == 0:
+                    continue
+                y0, y1, x0, x1 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+                patch = mask[y0:y1, x0:x1].copy()
+                loc = (y + int(y0), x + int(x0), int(y1 - y0), int(x1 - x0))
+                instances.append({
+                    "category_id": category,
+                    "score": score,
+                    "mask": LocalMask(loc, patch),
+                    "area": int(patch.sum()),
+                })
+        return instances
+
+    def __call__(self, img: NDArray[np.uint8] | LazyTiff) -> list[dict]:
+        """
+        COCO-style results (`XYWH` bbox, compressed RLE segmentation) of an RGB image,
+        like `encode_instances`.
+        """
+        img_h, img_w = img.shape[:2]
+        windows = self.windows(img)
+        instances = []
+        for i in range(0, len(windows), self.batch_size):
+            instances += self._predict_windows(img, windows[i:i + self.batch_size])
+        results = []
+        for instance in merge_instances(instances, self.iou_thresh, self.iomin_thresh):
+            y, x, h, w = instance["mask"].loc
+            results.append({
+                "category_id": instance["category_id"],
+                "score": round(instance["score"], 4),
+                "bbox": [x, y, w, h],
+                "segmentation": instance["mask"].rle(img_h, img_w),
+            })
+        return results
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the scripts and packages live in `src` and import each other from there
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
@@ -0,0 +1,30 @@
+import time
+from utils.crawl_ledger import CrawlLedger
+
+
+def test_claim_reclaims_stale_claims(tmp_path):
+    ledger = CrawlLedger(tmp_path / "crawl.sqlite")
+    assert ledger.claim(3, "killed-1", max_pid=10) == [1, 2, 3]
+    ledger.record(1, "done", 100, "1.jpg", 1, "0")
+    # still claimed by the killed worker, not claimed again before the timeout
+    assert ledger.claim(2, "worker-2", max_pid=10, timeout=60) == [4, 5]
+    ledger.conn.execute("UPDATE crawl SET updated = ? WHERE pid IN (2, 3)",
+                        (time.time() - 120,))
+    assert ledger.claim(2, "worker-2", max_pid=10, timeout=60) == [2, 3]
+    assert ledger.counts() == {"done": 1, "claimed": 4}
+
+
+def test_start_refreshes_claim(tmp_path):
+    ledger = CrawlLedger(tmp_path / "crawl.sqlite")
+    assert ledger.claim(3, "worker-1", max_pid=10) == [1, 2, 3]
+    ledger.conn.execute("UPDATE crawl SET updated = ?", (time.time() - 120,))
+    # pid 1 starts after waiting in the queue of worker-1
+    assert ledger.start(1, "worker-1")
+    # own stale claims aren't reclaimed, they are still queued
+    assert ledger.claim(2, "worker-1", max_pid=10, timeout=60) == [4, 5]
+    assert ledger.claim(3, "worker-2", max_pid=10, timeout=60) == [2, 3, 6]
+    # pids 2 and 3 are now crawled by worker-2 only
+    assert not ledger.start(2, "worker-1")
+    assert ledger.start(2, "worker-2")
+    ledger.record(1, "done", 100, "1.jpg", 1, "0")
+    assert not ledger.start(1, "worker-1")
@@ -0,0 +1,136 @@
+import asyncio
+import hashlib
+import importlib.util
+import os
+import aiohttp
+import pytest
+from aiohttp import web
+from utils.crawl_ledger import CrawlLedger
+
+spec = importlib.util.spec_from_file_location(
+    "crawler", os.path.join(os.path.dirname(__file__), "..", "src", "0-crawler.py")
+)
+crawler = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(crawler)
+
+PAGE_100 = """<html><body>
+<a id="a_download" href="/Image/{pid}_100.jpg">100 DPI</a>
+<a id="a_600picture" href="/Image/{pid}_600.jpg" style="display: none;">600 DPI</a>
+</body></html>"""
+PAGE_600 = """<html><body>
+<a id="a_download" href="/Image/{pid}_100.jpg">100 DPI</a>
+<a id="a_600picture" href="/Image/{pid}_600.jpg" style="">600 DPI</a>
+</body></html>"""
+PAGE_NONE = "<html><body>No download</body></html>"
+
+# pid: page, pids 4 and 5 serve the same file name
+PAGES = {1: PAGE_100, 2: PAGE_600, 3: PAGE_NONE, 4: PAGE_100, 5: PAGE_100}
+
+
+def image_bytes(name):
+    return hashlib.sha256(name.encode()).digest() * 1000
+
+
+async def content(request):
+    pid = int(request.query["pid"])
+    return web.Response(text=PAGES[pid].format(pid=pid), content_type="text/html")
+
+
+async def image(request):
+    name = request.match_info["name"]
+    pid = int(name.split("_")[0])
+    # the same file name for pids 4 and 5
+    filename = "same.jpg" if pid in (4, 5) else name
+    return web.Response(body=image_bytes(name),
+                        headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+async def crawl(tmp_path, max_pid):
+    app = web.Application()
+    app.add_routes([web.get("/Painting/Content", content), web.get("/Image/{name}", image)])
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    try:
+        npm_crawler = crawler.AsyncNPMCrawler(
+            tmp_path / "htmls", tmp_path / "images", tmp_path / "crawl.sqlite",
+            base_url=f"http://127.0.0.1:{port}", rate=100.0, claim_size=2,
+        )
+        await npm_crawler.crawl(max_pid)
+    finally:
+        await runner.cleanup()
+
+
+@pytest.fixture
+def crawled(tmp_path):
+    (tmp_path / "htmls").mkdir()
+    (tmp_path / "images").mkdir()
+    asyncio.run(crawl(tmp_path, max_pid=5))
+    return tmp_path
+
+
+def test_crawl_saves_images_and_ledger(crawled):
+    ledger = CrawlLedger(crawled / "crawl.sqlite")
+    rows = {
+        row[0]: row[1:]
+        for row in ledger.conn.execute(
+            "SELECT pid, status, dpi, filename, size, sha256 FROM crawl ORDER BY pid"
+        )
+    }
+    assert set(rows) == {1, 2, 3, 4, 5}
+    assert rows[1][:3] == ("done", 100, "1_100.jpg")
+    assert rows[2][:3] == ("done", 600, "2_600.jpg")
+    assert rows[3] == ("none", None, None, None, None)
+    # the second pid to save 'same.jpg' gets its pid prefixed
+    assert sorted([rows[4][2], rows[5][2]]) in (["4_same.jpg", "same.jpg"],
+                                                ["5_same.jpg", "same.jpg"])
+    served = {1: "1_100.jpg", 2: "2_600.jpg", 4: "4_100.jpg", 5: "5_100.jpg"}
+    for pid, name in served.items():
+        _, _, filename, size, sha256 = rows[pid]
+        data = (crawled / "images" / filename).read_bytes()
+        assert data == image_bytes(name)
+        assert (size, sha256) == (len(data), hashlib.sha256(data).hexdigest())
+    assert sorted(os.listdir(crawled / "htmls")) == [f"{pid}.html" for pid in PAGES]
+    assert ledger.check(crawled / "images") == ([], set(), set())
+
+
+async def request_statuses(tmp_path, statuses):
+    """Request a URL answering with each of `statuses` in turn, return (result, hits)."""
+    hits = []
+
+    async def handler(request):
+        hits.append(statuses[len(hits)])
+        return web.Response(text="ok", status=hits[-1])
+
+    app = web.Application()
+    app.add_routes([web.get("/status", handler)])
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    npm_crawler = crawler.AsyncNPMCrawler(
+        tmp_path / "htmls", tmp_path / "images", tmp_path / "crawl.sqlite", rate=100.0,
+        retries=2,
+    )
+    try:
+        async with aiohttp.ClientSession() as session:
+            url = f"http://127.0.0.1:{port}/status"
+            result = await npm_crawler.request(session, url, lambda r: r.text())
+    except aiohttp.ClientResponseError as e:
+        result = e.status
+    finally:
+        await runner.cleanup()
+    return result, hits
+
+
+@pytest.mark.parametrize("statuses, result, hits_n", [
+    ([404], 404, 1),
+    ([403], 403, 1),
+    ([503, 200], "ok", 2),
+    ([429, 500, 502], 502, 3),
+])
+def test_request_retries_only_429_and_5xx(tmp_path, statuses, result, hits_n):
+    assert asyncio.run(request_statuses(tmp_path, statuses)) == (result, statuses[:hits_n])
@@ -0,0 +1,34 @@
+import importlib.util
+import os
+import sys
+import numpy as np
+from PIL import Image
+
+spec = importlib.util.spec_from_file_location(
+    "dedup_stage", os.path.join(os.path.dirname(__file__), "..", "src", "0-dedup.py")
+)
+dedup = importlib.util.module_from_spec(spec)
+# registered, so that the worker processes can unpickle `hash_image`
+sys.modules["dedup_stage"] = dedup
+spec.loader.exec_module(dedup)
+
+
+def test_dedup_keeps_largest_and_skips_broken(tmp_path):
+    images_dir = tmp_path / "images"
+    images_dir.mkdir()
+    rng = np.random.default_rng(0)
+    painting = Image.fromarray(rng.integers(0, 256, size=(16, 12, 3), dtype=np.uint8))
+    painting = painting.resize((600, 800), Image.Resampling.BICUBIC)
+    painting.save(images_dir / "a_600.jpg")
+    painting.resize((150, 200)).save(images_dir / "a_100.jpg")
+    other = Image.fromarray(rng.integers(0, 256, size=(16, 12, 3), dtype=np.uint8))
+    other.resize((600, 800), Image.Resampling.BICUBIC).save(images_dir / "b.jpg")
+    # a truncated download
+    data = (images_dir / "b.jpg").read_bytes()
+    (images_dir / "c.jpg").write_bytes(data[:len(data) // 3])
+    (images_dir / "d.jpg").write_bytes(b"")
+
+    keep_list_path = tmp_path / "keep.txt"
+    dedup.dedup(str(images_dir), str(tmp_path / "clusters.csv"), str(keep_list_path),
+                workers=1)
+    assert keep_list_path.read_text().split() == ["a_600.jpg", "b.jpg"]
@@ -0,0 +1,54 @@
+import importlib.util
+import os
+import sqlite3
+import sys
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+spec = importlib.util.spec_from_file_location(
+    "extract_metadata", os.path.join(os.path.dirname(__file__), "..", "src",
+                                     "0-extract_metadata.py")
+)
+extract_metadata = importlib.util.module_from_spec(spec)
+# registered, so that the worker processes can unpickle `_parse_job`
+sys.modules["extract_metadata"] = extract_metadata
+spec.loader.exec_module(extract_metadata)
+
+
+def test_parse_metadata_splits_fields_at_br():
+    metadata = extract_metadata.parse_metadata(os.path.join(FIXTURES, "metadata_br.html"))
+    assert metadata == {
+        "title": "早春圖",
+        "artist": "郭熙",
+        "dynasty": "宋",
+        "material": "絹本",
+        "dimensions": "158.3x108.1",
+        "accession_number": "故畫000075",
+    }
+
+
+def test_parse_metadata_label_and_value_elements(tmp_path):
+    html_path = tmp_path / "1.html"
+    html_path.write_text(
+        "<html><body><dl><dt>品名</dt><dd>谿山行旅圖</dd><dt>作者</dt><dd>范寬</dd></dl>"
+        "<p><span>朝代</span><span>宋</span></p></body></html>",
+        encoding="utf-8",
+    )
+    metadata = extract_metadata.parse_metadata(str(html_path))
+    assert (metadata["title"], metadata["artist"], metadata["dynasty"]) == \
+        ("谿山行旅圖", "范寬", "宋")
+    assert metadata["material"] is None
+
+
+def test_extract_metadata_skips_unmodified_pages(tmp_path):
+    htmls_dir = tmp_path / "htmls"
+    htmls_dir.mkdir()
+    (htmls_dir / "7.html").write_bytes(
+        open(os.path.join(FIXTURES, "metadata_br.html"), "rb").read()
+    )
+    (htmls_dir / "8.html").write_bytes(b"")
+    db_path = str(tmp_path / "crawl.sqlite")
+    extract_metadata.extract_metadata(str(htmls_dir), db_path, workers=1)
+    extract_metadata.extract_metadata(str(htmls_dir), db_path, workers=1)
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT pid, title, artist FROM metadata ORDER BY pid").fetchall()
+    assert rows == [(7, "早春圖", "郭熙"), (8, None, None)]
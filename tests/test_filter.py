@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+from skimage import color
+from algorithms.filter import (
+    A_THRESHOLD,
+    B_THRESHOLD,
+    _auto_mask_seal_ins,
+    auto_filter_seal_ins,
+    auto_filter_seal_ins_batch,
+)
+
+
+def random_colors(seed, n=100_000):
+    return np.random.default_rng(seed).integers(0, 256, size=(n, 1, 3), dtype=np.uint8)
+
+
+def lab_edge_colors(img):
+    # colors within float32 precision of a Lab threshold, which the fast (float32) mask
+    # may classify differently
+    lab = color.rgb2lab(img, illuminant="D65")
+    a_edge = np.abs(lab[..., 1] - A_THRESHOLD) < 1e-3
+    b_edge = np.abs(lab[..., 2] - B_THRESHOLD) < 1e-3
+    return a_edge | b_edge
+
+
+@pytest.mark.parametrize("obj", ["seal", "inscription"])
+def test_fast_matches_round_trip(obj):
+    img = random_colors(0)
+    slow = auto_filter_seal_ins(img, obj)
+    fast = auto_filter_seal_ins(img, obj, fast=True)
+    keep = _auto_mask_seal_ins(img, obj)
+    # the kept pixels are the same, but the edge colors of the lab thresholds
+    differ = np.any(slow != 255, axis=-1) != keep
+    if obj == "seal":
+        assert np.all(lab_edge_colors(img)[differ])
+    else:
+        assert not differ.any()
+    # the kept pixels keep their values, off by up to 1 in the round trip
+    assert np.array_equal(fast[keep], img[keep])
+    both = keep & ~differ
+    assert np.abs(slow[both].astype(np.int16) - fast[both]).max() <= 1
+    # the other pixels are white
+    assert np.all(fast[~keep] == 255)
+    assert np.all(slow[~keep & ~differ] == 255)
+
+
+def test_batch_matches_per_box():
+    rng = np.random.default_rng(1)
+    imgs = [
+        rng.integers(0, 256, size=(*rng.integers(1, 40, size=2), 3), dtype=np.uint8)
+        for _ in range(20)
+    ]
+    objs = [["seal", "inscription"][i] for i in rng.integers(0, 2, size=20)]
+    batch = auto_filter_seal_ins_batch(imgs, objs)
+    for img, obj, img_filtered in zip(imgs, objs, batch):
+        assert np.array_equal(img_filtered, auto_filter_seal_ins(img, obj, fast=True))
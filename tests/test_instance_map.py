@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+from utils.instance_map import instance_masks, lama_mask, load_instance_map, save_instance_map
+
+
+def _instance_map(n, shape=(61, 83), seed=0):
+    """A map of `n` objects (and background) with an odd width, not byte aligned."""
+    rng = np.random.default_rng(seed)
+    instance_map = rng.integers(0, n + 1, size=shape).astype(np.uint16)
+    # every id present, the largest one included
+    instance_map.flat[:n + 1] = np.arange(n + 1)
+    return instance_map, rng.integers(0, 2, size=n).tolist()
+
+
+@pytest.mark.parametrize("ext", [".npz", ".png"])
+@pytest.mark.parametrize("n", [0, 1, 2, 255, 256, 300])
+def test_save_load_round_trip(tmp_path, ext, n):
+    instance_map, categories = _instance_map(n)
+    path = str(tmp_path / f"map{ext}")
+    save_instance_map(path, instance_map, categories)
+    loaded, loaded_categories = load_instance_map(path)
+    assert loaded.dtype == np.uint16
+    assert (loaded == instance_map).all()
+    assert loaded_categories == categories
+
+
+def test_save_unknown_format(tmp_path):
+    with pytest.raises(ValueError):
+        save_instance_map(str(tmp_path / "map.jpg"), *_instance_map(2))
+
+
+def test_lama_mask_and_instance_masks():
+    instance_map = np.array([[0, 1, 1], [2, 2, 0], [0, 3, 1]], dtype=np.uint16)
+    assert (lama_mask(instance_map) == [[0, 255, 255], [255, 255, 0], [0, 255, 255]]).all()
+    assert lama_mask(instance_map).dtype == np.uint8
+    masks = instance_masks(instance_map, 4)
+    assert len(masks) == 4
+    assert (masks[0] == [[0, 1, 1], [0, 0, 0], [0, 0, 1]]).all()
+    assert (masks[2] == [[0, 0, 0], [0, 0, 0], [0, 1, 0]]).all()
+    # an object fully covered by the ones pasted after it
+    assert not masks[3].any()
+    assert (sum(masks) == (instance_map != 0)).all()
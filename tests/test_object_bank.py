@@ -0,0 +1,28 @@
+import os
+import numpy as np
+from utils.io import write_png
+from utils.object_bank import ObjectBank
+
+
+def write_obj(obj_dir, name, value):
+    obj = np.full((4, 6, 3), 255, dtype=np.uint8)
+    obj[1:3, 2:4] = value
+    write_png(os.path.join(obj_dir, name), obj)
+
+
+def test_from_dir_cached_rebuilds_when_dir_changes(tmp_path):
+    obj_dir, path = tmp_path / "objs", str(tmp_path / "objs.bank")
+    obj_dir.mkdir()
+    write_obj(obj_dir, "a_seals_1_filtered.png", (200, 0, 0))
+    obj_bank = ObjectBank.from_dir_cached(str(obj_dir), path)
+    assert obj_bank.names == ["a_seals_1_filtered.png"]
+    assert obj_bank.anns == ["seal"]
+    assert obj_bank.masks[0].sum() == 4
+    # unchanged: memory-mapped from the saved bank
+    assert ObjectBank.from_dir_cached(str(obj_dir), path).source == obj_bank.source
+    # a box added by re-running the filter
+    write_obj(obj_dir, "a_inscriptions_1_filtered.png", (0, 0, 0))
+    obj_bank = ObjectBank.from_dir_cached(str(obj_dir), path)
+    assert obj_bank.names == ["a_inscriptions_1_filtered.png", "a_seals_1_filtered.png"]
+    assert obj_bank.anns == ["inscription", "seal"]
+    assert ObjectBank.load(path).names == obj_bank.names
@@ -0,0 +1,21 @@
+import json
+from utils.predictions import read_predicted
+
+
+def test_read_predicted_missing_file(tmp_path):
+    assert read_predicted(str(tmp_path / "predictions.jsonl")) == set()
+
+
+def test_read_predicted_truncates_interrupted_line(tmp_path):
+    path = tmp_path / "predictions.jsonl"
+    lines = [
+        json.dumps({"file_name": "a.jpg", "height": 2, "width": 3, "instances": []}) + "\n",
+        json.dumps({"file_name": "b.jpg", "error": "OSError('image file is truncated')"}) + "\n",
+    ]
+    path.write_text("".join(lines) + '{"file_name": "c.jpg", "hei')
+    assert read_predicted(str(path)) == {"a.jpg", "b.jpg"}
+    assert path.read_text() == "".join(lines)
+    # appending after the truncation gives valid lines
+    with open(path, "a") as f:
+        f.write(json.dumps({"file_name": "c.jpg", "instances": []}) + "\n")
+    assert read_predicted(str(path)) == {"a.jpg", "b.jpg", "c.jpg"}
@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+from pycocotools import mask as mask_utils
+from algorithms.random_paste import IncrementalSegmentation, LocalMask, PaintingObj, _smooth_gray
+
+
+def _full_segmentation(segmentation, img):
+    # the whole image segmented again, with the threshold and inversion kept
+    return segmentation._close(_smooth_gray(img) > segmentation.threshold)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_update_matches_full_segmentation(seed):
+    rng = np.random.default_rng(seed)
+    img = np.full((64, 64, 3), 230, dtype=np.uint8)
+    # some dark strokes as foreground
+    for _ in range(6):
+        y, x = rng.integers(0, 56, size=2)
+        img[y:y + rng.integers(2, 8), x:x + rng.integers(2, 8)] = rng.integers(0, 120)
+    segmentation = IncrementalSegmentation(img)
+    for _ in range(5):
+        y, x = rng.integers(0, 58, size=2)
+        h, w = rng.integers(1, 7, size=2)
+        img[y:y + h, x:x + w] = rng.integers(0, 256, size=(h, w, 3))
+        segmentation.update(img, y, x, h, w)
+        np.testing.assert_array_equal(segmentation.segmented,
+                                      _full_segmentation(segmentation, img))
+
+
+def test_update_matches_full_segmentation_on_noise():
+    # binary noise, where the closing often changes pixels just outside the blur of a
+    # pasted box (2 pixels further, by its dilation then erosion)
+    for seed in range(1000):
+        rng = np.random.default_rng(seed)
+        img = np.repeat((rng.random((24, 32, 1)) < 0.5).astype(np.uint8) * 255, 3, axis=2)
+        segmentation = IncrementalSegmentation(img)
+        img[8:14, 10:16] = rng.integers(0, 256, size=(6, 6, 1))
+        segmentation.update(img, 8, 10, 6, 6)
+        np.testing.assert_array_equal(segmentation.segmented,
+                                      _full_segmentation(segmentation, img), f"seed {seed}")
+
+
+def test_local_mask_rle_matches_full_mask():
+    rng = np.random.default_rng(0)
+    for _ in range(500):
+        height, width = rng.integers(1, 30, size=2)
+        h, w = rng.integers(1, height + 1), rng.integers(1, width + 1)
+        y, x = rng.integers(0, height - h + 1), rng.integers(0, width - w + 1)
+        local_mask = LocalMask((y, x, h, w), rng.random((h, w)) < 0.5)
+        rle = mask_utils.encode(np.asfortranarray(local_mask.dense((height, width))))
+        assert local_mask.rle(height, width)["counts"] == rle["counts"].decode("ascii")
+
+
+def _brute_force_valid_locs(background, obj_h, obj_w, by_conflict):
+    img_h, img_w = background.shape
+    valid = set()
+    # the top-left range of `_random_location`
+    for y in range(1, img_h - obj_h // 2 * 2 - 1):
+        for x in range(1, img_w - obj_w // 2 * 2 - 1):
+            is_conflict = not background[y:y + obj_h, x:x + obj_w].all()
+            if is_conflict == by_conflict:
+                valid.add((y, x))
+    return valid
+
+
+@pytest.mark.parametrize("by_conflict", [True, False])
+@pytest.mark.parametrize("seed", range(10))
+def test_valid_loc_map_matches_brute_force(seed, by_conflict):
+    rng = np.random.default_rng(seed)
+    img_h, img_w = rng.integers(20, 40, size=2)
+    obj_h, obj_w = rng.integers(1, 12, size=2)
+    # background with a few foreground blobs
+    background = np.ones((img_h, img_w), dtype=bool)
+    for _ in range(3):
+        y, x = rng.integers(0, 20, size=2)
+        background[y:y + rng.integers(1, 5), x:x + rng.integers(1, 5)] = False
+    img = np.zeros((img_h, img_w, 3), dtype=np.uint8)
+    obj = np.zeros((obj_h, obj_w, 3), dtype=np.uint8)
+    painting = PaintingObj(img, obj, 1, by_conflict, exhaustive=True,
+                           segmented_image=background)
+    expected = _brute_force_valid_locs(background, obj_h, obj_w, by_conflict)
+    assert set(zip(*np.nonzero(painting.valid_loc_map))) == expected
+    if expected:
+        assert painting.obj_loc[:2] in expected
+        assert painting.obj_loc[2:] == (obj_h, obj_w)
+    else:
+        assert painting.obj_loc is None
+
+
+@pytest.mark.parametrize("img_size, obj_size, by_conflict", [
+    # larger than the image, or as large (no room for the margin)
+    (20, 30, True),
+    (20, 20, True),
+    # fits, but no location free of foreground
+    (20, 5, False),
+])
+def test_exhaustive_drops_object_without_location(img_size, obj_size, by_conflict):
+    img = np.full((img_size, img_size, 3), 30, dtype=np.uint8)
+    obj = np.zeros((obj_size, obj_size, 3), dtype=np.uint8)
+    # all foreground
+    background = np.zeros((img_size, img_size), dtype=bool)
+    painting = PaintingObj(img, obj, 1, by_conflict, exhaustive=True,
+                           segmented_image=background)
+    assert painting.obj_loc is None
+    assert painting.bbox == []
+    assert painting.rle is None
+    assert not painting.mask.any()
+    assert (painting.img_pasted == img).all()
@@ -0,0 +1,78 @@
+import importlib.util
+import os
+import numpy as np
+import pytest
+from PIL import Image
+from utils.io import raw_tiff_chunks
+
+spec = importlib.util.spec_from_file_location(
+    "resize_stage", os.path.join(os.path.dirname(__file__), "..", "src", "1-resize.py")
+)
+resize = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(resize)
+
+
+def _painting(w, h, seed=0):
+    rng = np.random.default_rng(seed)
+    painting = Image.fromarray(rng.integers(0, 256, size=(h // 40, w // 40, 3), dtype=np.uint8))
+    return painting.resize((w, h), Image.Resampling.BICUBIC)
+
+
+def _psnr(a, b):
+    mse = np.mean((np.asarray(a, dtype=np.float64) - np.asarray(b, dtype=np.float64)) ** 2)
+    return 10 * np.log10(255 ** 2 / mse)
+
+
+@pytest.mark.parametrize("ext", [".jpg", ".tif", ".png"])
+def test_read_image_shrunk_matches_full_decode(tmp_path, ext):
+    path = str(tmp_path / f"painting{ext}")
+    _painting(3000, 2000).save(path)
+    shrunk = resize.read_image_shrunk(path, 800)
+    with Image.open(path) as image:
+        expected = image.convert("RGB").resize(shrunk.size, Image.Resampling.BILINEAR)
+    assert shrunk.size == (1200, 800)
+    assert shrunk.mode == "RGB"
+    assert _psnr(shrunk, expected) > 40
+
+
+def _assert_reduced(path, painting, chunks_n):
+    with Image.open(path) as image:
+        chunks = raw_tiff_chunks(image)
+    assert len(chunks) == chunks_n
+    reduced = resize.read_tiff_reduced(path, chunks, 2, 3)
+    expected = painting.reduce((2, 3))
+    assert reduced.size == expected.size
+    diff = np.abs(np.asarray(reduced, dtype=int) - np.asarray(expected, dtype=int))
+    assert diff.max() <= 1
+
+
+def test_read_tiff_reduced_by_strips(tmp_path):
+    path = str(tmp_path / "painting.tif")
+    painting = _painting(1001, 703)
+    # one strip, split by 64 rows
+    painting.save(path)
+    _assert_reduced(path, painting, 11)
+
+
+@pytest.mark.parametrize("kwargs, chunks_n", [
+    ({"rowsperstrip": 7}, 101),
+    # (rows, columns)
+    ({"tile": (64, 128)}, 11 * 8),
+])
+def test_read_tiff_reduced_by_tiles(tmp_path, kwargs, chunks_n):
+    tifffile = pytest.importorskip("tifffile")
+    path = str(tmp_path / "painting.tif")
+    painting = _painting(1001, 703)
+    tifffile.imwrite(path, np.asarray(painting), photometric="rgb", **kwargs)
+    _assert_reduced(path, painting, chunks_n)
+    shrunk = resize.read_image_shrunk(path, 300)
+    expected = painting.resize(shrunk.size, Image.Resampling.BILINEAR)
+    assert _psnr(shrunk, expected) > 40
+
+
+def test_resize_cmyk_to_png(tmp_path):
+    ori_path, tar_path = str(tmp_path / "cmyk.jpg"), str(tmp_path / "cmyk.png")
+    _painting(1600, 1200).convert("CMYK").save(ori_path)
+    resize.resize_image_to_800(ori_path, tar_path)
+    with Image.open(tar_path) as image:
+        assert (image.mode, image.size) == ("RGB", (800, 800))
@@ -0,0 +1,104 @@
+import numpy as np
+from PIL import Image
+from pycocotools import mask as mask_utils
+from algorithms.random_paste import LocalMask
+from utils.io import LazyTiff, read_image_lazy
+from utils.tiled_inference import TiledPredictor, _overlap, _union, merge_instances, tile_origins
+
+
+class _Tensor(np.ndarray):
+    def numpy(self):
+        return np.asarray(self)
+
+
+class _Instances:
+    """The fields of detectron2's `Instances` read by `TiledPredictor`."""
+
+    def __init__(self, masks):
+        self.pred_masks = np.array(masks, dtype=bool).reshape(-1, 800, 800).view(_Tensor)
+        self.scores = np.full(len(masks), 0.9).view(_Tensor)
+        self.pred_classes = np.zeros(len(masks), dtype=int).view(_Tensor)
+
+
+class StubPredictor:
+    """Predict the dark pixels of each window as one instance, recording the windows."""
+
+    def __init__(self):
+        self.windows = []
+
+    def prepare(self, window):
+        self.windows.append(window.shape)
+        return window
+
+    def __call__(self, inputs):
+        masks = [window.mean(axis=2) < 100 for window in inputs]
+        return [_Instances([mask] if mask.any() else []) for mask in masks]
+
+
+def _painting():
+    """A paper background with a dark seal across the seam of the first two windows."""
+    rng = np.random.default_rng(0)
+    img = rng.integers(225, 235, size=(1500, 2000, 3), dtype=np.uint8)
+    img[100:400, 700:1000] = 30
+    return img
+
+
+def test_tile_origins():
+    assert tile_origins(2000, 800, 200) == [0, 600, 1200]
+    assert tile_origins(1400, 800, 200) == [0, 600]
+    assert tile_origins(800, 800, 200) == [0]
+    assert tile_origins(500, 800, 200) == [0]
+
+
+def test_overlap_and_union():
+    a = LocalMask((0, 0, 2, 3), np.array([[1, 1, 0], [1, 1, 1]], dtype=bool))
+    b = LocalMask((1, 2, 2, 2), np.array([[1, 1], [0, 1]], dtype=bool))
+    assert _overlap(a, b) == 1
+    assert _overlap(a, LocalMask((5, 5, 1, 1), np.ones((1, 1), dtype=bool))) == 0
+    union = _union(a, b)
+    assert union.loc == (0, 0, 3, 4)
+    expected = np.array([[1, 1, 0, 0], [1, 1, 1, 1], [0, 0, 0, 1]], dtype=bool)
+    assert (union.patch == expected).all()
+
+
+def _instance(loc, score, category=0):
+    patch = np.ones(loc[2:], dtype=bool)
+    return {"category_id": category, "score": score, "mask": LocalMask(loc, patch),
+            "area": int(patch.sum())}
+
+
+def test_merge_instances_across_seam():
+    instances = [
+        # an object cut by the seam at x=800, and whole in the next window
+        _instance((100, 700, 300, 100), 0.8),
+        _instance((100, 700, 300, 300), 0.9),
+        # the same place, another category
+        _instance((100, 700, 300, 100), 0.7, category=1),
+        # another object
+        _instance((500, 500, 50, 50), 0.95),
+    ]
+    merged = merge_instances(instances)
+    assert [(i["category_id"], i["mask"].loc) for i in merged] == [
+        (0, (500, 500, 50, 50)), (0, (100, 700, 300, 300)), (1, (100, 700, 300, 100)),
+    ]
+
+
+def test_windows_skip_background():
+    predictor = TiledPredictor(StubPredictor(), tile=800, overlap=200)
+    assert predictor.windows(_painting()) == [(0, 0, 800, 800), (0, 600, 800, 800)]
+
+
+def test_tiled_predictor_merges_seam(tmp_path):
+    img = _painting()
+    path = str(tmp_path / "painting.tif")
+    Image.fromarray(img).save(path)
+    lazy = read_image_lazy(path)
+    assert isinstance(lazy, LazyTiff)
+    for image in (img, lazy):
+        stub = StubPredictor()
+        results = TiledPredictor(stub, tile=800, overlap=200)(image)
+        # the background windows are never read
+        assert stub.windows == [(800, 800, 3)] * 2
+        assert [(i["category_id"], i["bbox"]) for i in results] == [(0, [700, 100, 300, 300])]
+        mask = mask_utils.decode(results[0]["segmentation"]).astype(bool)
+        assert (mask == (img.mean(axis=2) < 100)).all()